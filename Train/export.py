@@ -10,6 +10,7 @@ import time
 import warnings
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import torch
 from torch.utils.mobile_optimizer import optimize_for_mobile
@@ -23,7 +24,7 @@ if platform.system() != 'Windows':
 
 from models.experimental import attempt_load, End2End
 from models.yolo import ClassificationModel, Detect, DDetect, DualDetect, DualDDetect, DetectionModel, SegmentationModel
-from utils.dataloaders import LoadImages
+from utils.dataloaders import LoadImages, LoadImagesAndLabels
 from utils.general import (LOGGER, Profile, check_dataset, check_img_size, check_requirements, check_version,
                            check_yaml, colorstr, file_size, get_default_args, print_args, url2file, yaml_save)
 from utils.torch_utils import select_device, smart_inference_mode
@@ -141,7 +142,8 @@ def export_onnx(model, im, file, opset, dynamic, simplify, prefix=colorstr('ONNX
     
 
 @try_export
-def export_onnx_end2end(model, im, file, simplify, topk_all, iou_thres, conf_thres, device, labels, prefix=colorstr('ONNX END2END:')):
+def export_onnx_end2end(model, im, file, simplify, topk_all, iou_thres, conf_thres, device, labels, engine='greedy',
+                        prefix=colorstr('ONNX END2END:')):
     # YOLO ONNX export
     check_requirements('onnx')
     import onnx
@@ -158,7 +160,7 @@ def export_onnx_end2end(model, im, file, simplify, topk_all, iou_thres, conf_thr
                     'det_classes': {0: 'batch'},
                 }
     dynamic_axes.update(output_axes)
-    model = End2End(model, topk_all, iou_thres, conf_thres, None ,device, labels)
+    model = End2End(model, topk_all, iou_thres, conf_thres, None ,device, labels, engine)
 
     output_names = ['num_dets', 'det_boxes', 'det_scores', 'det_classes']
     shapes = [ batch_size, 1,  batch_size,  topk_all, 4,
@@ -216,6 +218,87 @@ def export_openvino(file, metadata, half, prefix=colorstr('OpenVINO:')):
     return f, None
 
 
+def calibration_images(data, imgsz, stride, ncalib=300, prefix=colorstr('INT8:')):
+    # Yield up to ncalib (1,3,h,w) float32 0-1 images from the dataset train split, letterboxed like val_dual
+    dataset = LoadImagesAndLabels(check_dataset(check_yaml(data))['train'], imgsz, stride=stride, prefix=prefix)
+    n = min(ncalib, len(dataset))
+    LOGGER.info(f'{prefix} calibrating on {n} of {len(dataset)} images...')
+    for i in np.random.default_rng(0).choice(len(dataset), n, replace=False):
+        yield dataset[i][0][None].float().numpy() / 255
+
+
+@try_export
+def export_onnx_int8(file, data, imgsz, stride, ncalib, prefix=colorstr('ONNX INT8:')):
+    # YOLO ONNX Runtime static INT8 post-training quantization (QDQ), from the FP32 ONNX model
+    check_requirements(('onnx', 'onnxruntime'))
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    LOGGER.info(f'\n{prefix} starting quantization with onnx {onnx.__version__}...')
+    f_fp32, f = file.with_suffix('.onnx'), str(file).replace('.pt', '-int8.onnx')
+    name = onnx.load(f_fp32, load_external_data=False).graph.input[0].name
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.images = calibration_images(data, imgsz, stride, ncalib, prefix)
+
+        def get_next(self):
+            im = next(self.images, None)
+            return None if im is None else {name: im}
+
+    quantize_static(str(f_fp32),
+                    f,
+                    Reader(),
+                    quant_format=QuantFormat.QDQ,
+                    op_types_to_quantize=['Conv', 'MatMul'],  # box decoding (DFL, dist2bbox, concat) stays FP32
+                    per_channel=True,
+                    activation_type=QuantType.QInt8,
+                    weight_type=QuantType.QInt8)
+
+    # Metadata
+    model_fp32, model_int8 = onnx.load(f_fp32, load_external_data=False), onnx.load(f)
+    onnx.helper.set_model_props(model_int8, {p.key: p.value for p in model_fp32.metadata_props})
+    onnx.save(model_int8, f)
+    return f, None
+
+
+@try_export
+def export_openvino_int8(file, metadata, data, imgsz, stride, ncalib, prefix=colorstr('OpenVINO INT8:')):
+    # YOLO OpenVINO static INT8 post-training quantization with NNCF, from the FP32 OpenVINO model
+    check_requirements('nncf>=2.5.0')
+    import nncf
+    from openvino.runtime import Core, serialize
+
+    LOGGER.info(f'\n{prefix} starting quantization with nncf {nncf.__version__}...')
+    f_fp32 = Path(str(file).replace('.pt', f'_openvino_model{os.sep}'))
+    f = str(file).replace('.pt', f'_int8_openvino_model{os.sep}')
+    model = Core().read_model(next(f_fp32.glob('*.xml')))
+    images = list(calibration_images(data, imgsz, stride, ncalib, prefix))
+    model = nncf.quantize(model, nncf.Dataset(images), preset=nncf.QuantizationPreset.MIXED, subset_size=len(images))
+    serialize(model, str(Path(f) / file.with_suffix('.xml').name))
+    yaml_save(Path(f) / file.with_suffix('.yaml').name, metadata)  # add metadata.yaml
+    return f, None
+
+
+def int8_report(data, files, imgsz, prefix=colorstr('INT8:')):
+    # Validate FP32/INT8 model pairs [(fp32, int8), ...] with val_dual on CPU, log and return mAP and speed deltas
+    from Train.val_dual import run as val
+
+    rows = []
+    for f_fp32, f_int8 in files:
+        for f in f_fp32, f_int8:
+            LOGGER.info(f'\n{prefix} validating {f}...')
+            r, _, t = val(data, f, batch_size=1, imgsz=imgsz, device='cpu', half=False, plots=False,
+                          project=Path(f_int8).parent / 'int8_report', exist_ok=True)
+            rows.append([Path(f).name, r[2], r[3], t[1]])
+    df = pd.DataFrame(rows, columns=['Model', 'mAP50', 'mAP50-95', 'Inference (ms)'])
+    fp32 = df.iloc[::2].reset_index(drop=True)
+    df['Delta mAP50-95'] = df['mAP50-95'] - fp32['mAP50-95'].repeat(2).values
+    df['Speedup'] = fp32['Inference (ms)'].repeat(2).values / df['Inference (ms)']
+    LOGGER.info(f'\n{prefix} FP32 vs INT8 report\n{df.round(4).to_string(index=False)}')
+    return df
+
+
 @try_export
 def export_paddle(model, im, file, metadata, prefix=colorstr('PaddlePaddle:')):
     # YOLO Paddle export
@@ -515,7 +598,9 @@ def run(
         inplace=False,  # set YOLO Detect() inplace=True
         keras=False,  # use Keras
         optimize=False,  # TorchScript: optimize for mobile
-        int8=False,  # CoreML/TF INT8 quantization
+        int8=False,  # CoreML/TF/ONNX/OpenVINO INT8 quantization
+        ncalib=300,  # ONNX/OpenVINO INT8: calibration images
+        int8_val=True,  # ONNX/OpenVINO INT8: validate FP32 and INT8 models, report mAP and speed deltas
         dynamic=False,  # ONNX/TF/TensorRT: dynamic axes
         simplify=False,  # ONNX: simplify model
         opset=12,  # ONNX: opset version
@@ -527,6 +612,8 @@ def run(
         topk_all=100,  # TF.js NMS: topk for all classes to keep
         iou_thres=0.45,  # TF.js NMS: IoU threshold
         conf_thres=0.25,  # TF.js NMS: confidence threshold
+        nms_engine='greedy',  # ONNX END2END: NMS algorithm, matrix/cluster export as plain ONNX ops
+        prune=True,  # drop the auxiliary branch of dual-head models, single-head exported graph
 ):
     t = time.time()
     include = [x.lower() for x in include]  # to lowercase
@@ -541,7 +628,10 @@ def run(
     if half:
         assert device.type != 'cpu' or coreml, '--half only compatible with GPU export, i.e. use --device 0'
         assert not dynamic, '--half not compatible with --dynamic, i.e. use either --half or --dynamic but not both'
-    model = attempt_load(weights, device=device, inplace=True, fuse=True)  # load FP32 model
+    if int8 and (onnx or xml):
+        assert not half, '--int8 ONNX/OpenVINO quantization requires an FP32 export, remove --half'
+        assert len(imgsz) == 1 or imgsz[0] == imgsz[1], '--int8 ONNX/OpenVINO calibration requires a square --imgsz'
+    model = attempt_load(weights, device=device, inplace=True, fuse=True, prune=prune)  # load FP32 model
 
     # Checks
     imgsz *= 2 if len(imgsz) == 1 else 1  # expand
@@ -576,16 +666,29 @@ def run(
         f[0], _ = export_torchscript(model, im, file, optimize)
     if engine:  # TensorRT required before ONNX
         f[1], _ = export_engine(model, im, file, half, dynamic, simplify, workspace, verbose)
+    f_onnx = ''  # plain ONNX model, f[2] is replaced by the END2END model if both are exported
     if onnx or xml:  # OpenVINO requires ONNX
         f[2], _ = export_onnx(model, im, file, opset, dynamic, simplify)
+        f_onnx = f[2]
     if onnx_end2end:
         if isinstance(model, DetectionModel):
             labels = model.names
-            f[2], _ = export_onnx_end2end(model, im, file, simplify, topk_all, iou_thres, conf_thres, device, len(labels))
+            f[2], _ = export_onnx_end2end(model, im, file, simplify, topk_all, iou_thres, conf_thres, device, len(labels),
+                                          nms_engine)
         else:
             raise RuntimeError("The model is not a DetectionModel.")
     if xml:  # OpenVINO
         f[3], _ = export_openvino(file, metadata, half)
+    if int8 and (onnx or xml):  # static INT8 post-training quantization
+        fq = []  # (fp32, int8) pairs
+        if onnx and f_onnx:  # INT8 model is quantized from the plain ONNX model, compare against it
+            fq.append((f_onnx, export_onnx_int8(file, data, imgsz[0], gs, ncalib)[0]))
+        if xml and f[3]:
+            fq.append((f[3], export_openvino_int8(file, metadata, data, imgsz[0], gs, ncalib)[0]))
+        fq = [x for x in fq if x[1]]
+        f += [x[1] for x in fq]
+        if int8_val and fq:
+            int8_report(data, fq, imgsz[0])
     if coreml:  # CoreML
         f[4], _ = export_coreml(model, im, file, int8, half)
     if any((saved_model, pb, tflite, edgetpu, tfjs)):  # TensorFlow formats
@@ -647,7 +750,9 @@ def parse_opt():
     parser.add_argument('--inplace', action='store_true', help='set YOLO Detect() inplace=True')
     parser.add_argument('--keras', action='store_true', help='TF: use Keras')
     parser.add_argument('--optimize', action='store_true', help='TorchScript: optimize for mobile')
-    parser.add_argument('--int8', action='store_true', help='CoreML/TF INT8 quantization')
+    parser.add_argument('--int8', action='store_true', help='CoreML/TF/ONNX/OpenVINO INT8 quantization')
+    parser.add_argument('--ncalib', type=int, default=300, help='ONNX/OpenVINO INT8: calibration images')
+    parser.add_argument('--no-int8-report', dest='int8_val', action='store_false', help='skip INT8 mAP/speed report')
     parser.add_argument('--dynamic', action='store_true', help='ONNX/TF/TensorRT: dynamic axes')
     parser.add_argument('--simplify', action='store_true', help='ONNX: simplify model')
     parser.add_argument('--opset', type=int, default=12, help='ONNX: opset version')
@@ -659,6 +764,9 @@ def parse_opt():
     parser.add_argument('--topk-all', type=int, default=100, help='ONNX END2END/TF.js NMS: topk for all classes to keep')
     parser.add_argument('--iou-thres', type=float, default=0.45, help='ONNX END2END/TF.js NMS: IoU threshold')
     parser.add_argument('--conf-thres', type=float, default=0.25, help='ONNX END2END/TF.js NMS: confidence threshold')
+    parser.add_argument('--nms-engine', default='greedy', choices=('greedy', 'matrix', 'cluster'),
+                        help='ONNX END2END: NMS algorithm, greedy uses the TensorRT plugin')
+    parser.add_argument('--no-prune', dest='prune', action='store_false', help='keep dual-head auxiliary branch')
     parser.add_argument(
         '--include',
         nargs='+',
@@ -21,6 +21,7 @@ from utils.general import (LOGGER, TQDM_BAR_FORMAT, Profile, check_dataset, chec
                            check_yaml, coco80_to_coco91_class, colorstr, increment_path, non_max_suppression,
                            print_args, scale_boxes, xywh2xyxy, xyxy2xywh)
 from utils.metrics import ConfusionMatrix, ap_per_class, box_iou
+from utils.nms import NMS_ENGINES
 from utils.plots import output_to_target, plot_images, plot_val_study
 from utils.torch_utils import select_device, smart_inference_mode
 
@@ -82,6 +83,9 @@ def run(
         conf_thres=0.001,  # confidence threshold
         iou_thres=0.7,  # NMS IoU threshold
         max_det=300,  # maximum detections per image
+        topk=None,  # maximum NMS candidates per image
+        topk_per_class=None,  # maximum NMS candidates per class and image
+        nms='greedy',  # NMS engine, see utils/nms.py
         task='val',  # train, val, test, speed or study
         device='',  # cuda device, i.e. 0 or 0,1,2,3 or cpu
         workers=8,  # max dataloader workers (per RANK in DDP mode)
@@ -160,7 +164,7 @@ def run(
                                        pad=pad,
                                        rect=rect,
                                        workers=workers,
-                                       min_items=opt.min_items,
+                                       min_items=min_items,
                                        prefix=colorstr(f'{task}: '))[0]
 
     seen = 0
@@ -196,7 +200,9 @@ def run(
             #train_out = train_out[1]
             #loss += compute_loss(train_out, targets)[1]  # box, obj, cls
         else:
-            preds = preds[0][1]
+            if isinstance(preds, (list, tuple)) and isinstance(preds[1], (list, tuple)):
+                preds = preds[0]  # PyTorch (y, train_out) to y
+            preds = preds[1] if isinstance(preds, (list, tuple)) else preds  # dual heads [aux, main] to main, pruned y
 
         # NMS
         targets[:, 2:] *= torch.tensor((width, height, width, height), device=device)  # to pixels
@@ -208,7 +214,10 @@ def run(
                                         labels=lb,
                                         multi_label=True,
                                         agnostic=single_cls,
-                                        max_det=max_det)
+                                        max_det=max_det,
+                                        topk=topk,
+                                        topk_per_class=topk_per_class,
+                                        engine=nms)
 
         # Metrics
         for si, pred in enumerate(preds):
@@ -331,6 +340,9 @@ def parse_opt():
     parser.add_argument('--conf-thres', type=float, default=0.001, help='confidence threshold')
     parser.add_argument('--iou-thres', type=float, default=0.7, help='NMS IoU threshold')
     parser.add_argument('--max-det', type=int, default=300, help='maximum detections per image')
+    parser.add_argument('--topk', type=int, default=None, help='maximum NMS candidates per image')
+    parser.add_argument('--topk-per-class', type=int, default=None, help='maximum NMS candidates per class and image')
+    parser.add_argument('--nms', default='greedy', choices=NMS_ENGINES, help='NMS engine')
     parser.add_argument('--task', default='val', help='train, val, test, speed or study')
     parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--workers', type=int, default=8, help='max dataloader workers (per RANK in DDP mode)')
@@ -4,10 +4,22 @@ import cv2
 from PIL import Image, ImageTk
 import torch
 import numpy as np
-from deep_sort_realtime.deepsort_tracker import DeepSort
 from models.common import DetectMultiBackend, AutoShape
-import threading
+from utils.dataloaders import VID_FORMATS, VideoSource
+from utils.gating import KeyframeScheduler, MotionGate, merge_regions
+from utils.general import LOGGER, check_requirements, increment_path, print_args
+from utils.pipeline import EOS, Pipeline
+from utils.telemetry import Telemetry
+from utils.tiling import tiled_inference
+from utils.torch_utils import smart_inference_mode
+from utils.trackers import create_tracker
 import argparse
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import current_process, get_context
+from pathlib import Path
 
 class ObjectDetectionGUI:
     def __init__(self, root):
@@ -19,7 +31,11 @@ class ObjectDetectionGUI:
         self.video_path = None        # Đường dẫn đến file video
         self.is_playing = False       # Trạng thái phát video
         self.cap = None               # Đối tượng để đọc video
+        self.pipeline = None          # Pipeline nhiều stage (capture, preprocess, inference, tracking, render)
         self.selected_class = tk.StringVar()  # Biến lưu class được chọn
+        self.display_size = (640, 480)  # Kích thước vùng hiển thị, cập nhật từ main thread
+        self.display_bufs = None      # Các buffer RGB dùng lại cho frame hiển thị
+        self.photo = None             # PhotoImage dùng lại, chỉ tạo mới khi kích thước thay đổi
         
         # Tạo giao diện
         self.create_widgets()
@@ -29,8 +45,29 @@ class ObjectDetectionGUI:
             weights='runs/train/vehicle_person/weights/best.pt',  # Đường dẫn đến file weights
             data='data.yaml',                                     # File cấu hình data
             conf_thres=0.5,                                      # Ngưỡng tin cậy
-            device=''                                            # Thiết bị xử lý (GPU/CPU)
+            device='',                                           # Thiết bị xử lý (GPU/CPU)
+            img_size=640,                                        # Kích thước ảnh đầu vào model
+            queue_size=2,                                        # Số frame tối đa trong hàng đợi của mỗi stage
+            drop_policy='oldest',                                # 'oldest': bỏ frame cũ nhất khi đầy, 'block': chờ
+            stats_interval=100,                                  # In thống kê pipeline sau mỗi N frame (0: tắt)
+            detect_interval=1,                                   # Chạy YOLO mỗi N frame, frame giữa chỉ dự đoán Kalman
+            motion_thres=0.0,                                    # Chạy YOLO sớm hơn khi chuyển động > ngưỡng (0: tắt)
+            tracker='deepsort',                                  # 'deepsort' hoặc 'bytetrack' (IoU + Kalman, không CNN)
+            embedder='mobilenet',                                # 'yolo': embedding từ neck YOLO, bỏ CNN của DeepSort
+            decode_buffer=4,                                     # Số frame giải mã trước trong thread riêng
+            decode_size=None,                                    # (w, h) resize ngay khi giải mã, None: giữ nguyên
+            hw_decode=False,                                     # Giải mã video bằng phần cứng nếu OpenCV hỗ trợ
+            display_fps=60,                                      # Giới hạn tốc độ hiển thị (tần số quét màn hình)
+            tile=0,                                              # Kích thước tile, chạy chung một batch (0: tắt)
+            tile_overlap=0.2,                                    # Tỉ lệ chồng lấn giữa các tile
+            rois=None,                                           # Chỉ detect trong các vùng [[x1, y1, x2, y2], ...]
+            motion_gate=None,                                    # 'mog2'/'diff': bỏ qua YOLO khi không có chuyển động
+            metrics_port=0,                                      # Cổng HTTP cho Prometheus /metrics (0: tắt)
+            ort_threads=0,                                       # Số thread ONNX Runtime (0: mặc định)
+            ov_hint='LATENCY'                                    # Performance hint OpenVINO: LATENCY/THROUGHPUT
         )
+        self.telemetry = Telemetry().serve(self.args.metrics_port) if self.args.metrics_port else None
+        self.stream = 'default'       # Tên luồng video trong metrics
         
         # Khởi tạo model và detector
         self.setup_detector()
@@ -62,21 +99,41 @@ class ObjectDetectionGUI:
         # Listbox để chọn nhiều class
         self.class_listbox = tk.Listbox(class_frame, selectmode=tk.MULTIPLE, height=5)
         self.class_listbox.grid(row=0, column=1, padx=5)
+        self.class_listbox.bind('<<ListboxSelect>>', self.apply_class_filter)
         
         # Frame hiển thị video
         self.video_frame = ttk.Label(main_frame)
         self.video_frame.grid(row=1, column=0, columnspan=3, pady=10)
 
     def setup_detector(self):
+        self.load_detector()
+        
+        # Xóa danh sách cũ trong listbox
+        self.class_listbox.delete(0, tk.END)
+        
+        # Chỉ thêm person và vehicle vào listbox
+        for class_name in self.class_names:
+            if class_name.lower() in ['person', 'vehicle']:
+                self.class_listbox.insert(tk.END, class_name)
+        
+        # Chọn class đầu tiên làm mặc định
+        if self.class_names:
+            self.class_listbox.selection_set(0)
+        self.apply_class_filter()
+
+    def load_detector(self):
         # Khởi tạo model với GPU nếu có
         self.model = DetectMultiBackend(
             weights=self.args.weights,
             device=torch.device(self.args.device) if self.args.device else \
                    torch.device('cuda' if torch.cuda.is_available() else 'cpu'),
-            fuse=True
+            fuse=True,
+            ort_opts={'intra_op_threads': self.args.ort_threads},
+            ov_opts={'hint': self.args.ov_hint}
         )
         self.model = AutoShape(self.model)  # Tự động xử lý kích thước ảnh đầu vào
-        self.tracker = DeepSort(max_age=30)  # Khởi tạo tracker với max_age=30 frames
+        self.model.embed = self.args.tracker == 'deepsort' and self.args.embedder == 'yolo'  # embedding từ neck
+        self.tracker = self.new_tracker()
         
         # Đọc danh sách classes từ file
         try:
@@ -88,18 +145,11 @@ class ObjectDetectionGUI:
         
         # Tạo màu ngẫu nhiên cho mỗi class
         self.colors = np.random.randint(0, 255, size=(len(self.class_names), 3))
-        
-        # Xóa danh sách cũ trong listbox
-        self.class_listbox.delete(0, tk.END)
-        
-        # Chỉ thêm person và vehicle vào listbox
-        for class_name in self.class_names:
-            if class_name.lower() in ['person', 'vehicle']:
-                self.class_listbox.insert(tk.END, class_name)
-        
-        # Chọn class đầu tiên làm mặc định
-        if self.class_names:
-            self.class_listbox.selection_set(0)
+
+    def new_tracker(self):
+        # Khởi tạo tracker với max_age=30 frames
+        kwargs = dict(embedder=self.args.embedder) if self.args.tracker == 'deepsort' else {}
+        return create_tracker(self.args.tracker, max_age=30, **kwargs)
 
     def select_video(self):
         # Mở hộp thoại chọn file video
@@ -110,12 +160,8 @@ class ObjectDetectionGUI:
             # Cập nhật UI khi đã chọn video
             self.path_label.config(text=self.video_path)
             self.start_btn.config(state=tk.NORMAL)
-            # Đóng video cũ nếu đang mở
-            if self.cap is not None:
-                self.cap.release()
-                self.cap = None
-            self.is_playing = False
-            self.start_btn.config(text="Start")
+            # Dừng pipeline cũ nếu đang chạy
+            self.stop_detection()
 
     def toggle_detection(self):
         # Xử lý khi nhấn nút Start/Stop
@@ -123,125 +169,443 @@ class ObjectDetectionGUI:
             if self.video_path:
                 self.is_playing = True
                 self.start_btn.config(text="Stop")
-                # Chạy detection trong thread riêng
-                threading.Thread(target=self.run_detection, daemon=True).start()
+                # Chạy detection trong pipeline nhiều thread
+                self.run_detection()
         else:
             # Dừng detection
-            self.is_playing = False
-            self.start_btn.config(text="Start")
-            if self.cap:
-                self.cap.release()
-                self.cap = None
+            self.stop_detection()
+
+    def stop_detection(self):
+        # Dừng pipeline và giải phóng video
+        self.is_playing = False
+        self.start_btn.config(text="Start")
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
 
     def get_selected_classes(self):
         # Lấy danh sách các class được chọn từ listbox
         selected_indices = self.class_listbox.curselection()
         return [self.class_names[i] for i in selected_indices]
 
+    def apply_class_filter(self, event=None):
+        # Đưa class được chọn và ngưỡng tin cậy vào NMS của AutoShape (áp dụng ngay, không cần nạp lại model)
+        self.selected_classes = self.get_selected_classes()
+        self.model.classes = self.tracked_class_ids(self.class_names, self.selected_classes)
+        self.model.conf = self.args.conf_thres
+
+    def read_frames(self):
+        # Stage capture: đọc từng frame từ video (giải mã trước trong thread riêng, frame cấp phát sẵn)
+        hold = 5 * self.args.queue_size + 6  # số frame tối đa đang nằm trong pipeline (4 stage + output)
+        self.cap = cap = VideoSource(self.video_path, self.args.decode_buffer, hold, self.args.decode_size,
+                                     hw_accel=self.args.hw_decode)
+        try:
+            while self.is_playing:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if self.args.drop_policy == 'oldest':
+                    # Capture không bao giờ chờ nên số frame trong pipeline không bị giới hạn: ring có thể quay vòng
+                    # và ghi đè frame đang được xử lý, phải copy ra khỏi ring
+                    frame = frame.copy()
+                yield {'frame': frame}
+        finally:
+            # Giải phóng video khi kết thúc (cap cục bộ: self.cap có thể đã là video mới)
+            cap.release()
+
+    def reset_gating(self):
+        # Bộ chọn keyframe và motion gate cho một video mới
+        self.scheduler = KeyframeScheduler(self.args.detect_interval, self.args.motion_thres)
+        self.gate = MotionGate(self.args.motion_gate) if self.args.motion_gate else None
+        self.track_boxes = []  # vị trí các track đã xác nhận, cập nhật bởi stage tracking
+        self.last_tracks = []  # tracks của frame trước, dùng lại khi không có chuyển động
+        self.tentative = False  # tracker đang có track chưa xác nhận, đặt bởi stage tracking
+
+    def preprocess(self, item):
+        # Stage preprocess: chọn keyframe, motion gate, letterbox và chuyển frame sang tensor BCHW
+        item['key'] = self.scheduler(item['frame'])
+        item['rois'], item['still'] = self.args.rois, False
+        if self.gate is not None:
+            motion = self.gate(item['frame'])  # chạy trên mọi frame để cập nhật mô hình nền
+            item['still'] = not motion
+            if item['key'] and not motion:
+                item['key'] = False  # không có chuyển động: bỏ qua YOLO, giữ nguyên tracks
+            elif item['key']:
+                # Chỉ detect trong vùng chuyển động và quanh các track hiện có (vật thể đứng yên vẫn được giữ)
+                item['rois'] = merge_regions(motion + self.track_boxes, self.gate.max_regions)
+        if not item['key'] or self.args.tile or item['rois']:
+            return item  # frame giữa các keyframe: bỏ qua detector, chế độ tile/ROI: cắt vùng trong stage inference
+        item['x'], _, _, item['shape0'], item['shape1'] = self.model.preprocess(item['frame'], self.args.img_size)
+        return item
+
+    @smart_inference_mode()
+    def inference(self, item):
+        # Stage inference: chạy model và NMS
+        item['embeds'] = None
+        if not item['key'] and self.tentative and not item['still']:
+            # Track mới cần detection liên tiếp để được xác nhận: chạy YOLO ngay trên frame này. Quyết định ở đây
+            # (không phải preprocess) để chỉ trễ so với stage tracking đúng số frame trong hàng đợi tracking
+            item['key'] = True
+            if not (self.args.tile or item['rois']):
+                x = self.model.preprocess(item['frame'], self.args.img_size)
+                item['x'], item['shape0'], item['shape1'] = x[0], x[3], x[4]
+        if not item['key']:
+            item['det'] = None  # tracker tự dự đoán vị trí
+            return item
+        if self.args.tile or item['rois']:
+            # Tile chồng lấn (và ROI) qua model trong một batch, gộp kết quả bằng NMS giữa các tile
+            y = tiled_inference(self.model, item['frame'], self.args.tile or self.args.img_size, self.args.tile_overlap,
+                                item['rois'], embed=self.model.embed)
+            item['det'], item['embeds'] = y if self.model.embed else (y, None)
+            return item
+        y = self.model(item.pop('x'))
+        t = time.perf_counter()
+        if self.model.embed:
+            y, e = self.model.postprocess(y, item['shape0'], item['shape1'], embed=True)
+            item['embeds'] = e[0]  # embedding (n,c) cho từng detection
+        else:
+            y = self.model.postprocess(y, item['shape0'], item['shape1'])
+        item['det'] = y[0]
+        if self.telemetry:
+            self.telemetry.observe('nms', time.perf_counter() - t, self.stream)  # NMS nằm trong stage inference
+        return item
+
+    def tracking(self, item):
+        # Stage tracking: lọc detection và cập nhật tracker
+        if item['still'] and item['det'] is None:
+            item['tracks'] = self.last_tracks  # không có chuyển động: tracks đứng yên, không bị tính là mất detection
+            return item
+        item['tracks'] = self.update_tracker(item['frame'], item['det'], self.tracker, self.class_names,
+                                             self.args.conf_thres, selected_classes=item['selected_classes'],
+                                             embeds=item['embeds'])
+        self.last_tracks = item['tracks']
+        self.tentative = any(not t.is_confirmed() for t in item['tracks'])  # stage inference đọc cờ này
+        if self.gate is not None:
+            self.track_boxes = [[int(x) for x in t.to_ltrb()] for t in item['tracks'] if t.is_confirmed()]
+        return item
+
+    def render(self, item):
+        # Stage render: vẽ tracks, resize và chuyển sang RGB vào buffer dùng lại để hiển thị trong GUI
+        t = time.monotonic()
+        if t - self.last_render < 1 / self.args.display_fps:
+            return None  # vượt quá tốc độ hiển thị: bỏ frame (tracker vẫn đã xử lý frame này)
+        self.last_render = t
+        frame = self.draw_tracks(item['frame'], item['tracks'], self.class_names, self.colors)
+        
+        # Điều chỉnh kích thước frame cho phù hợp với cửa sổ (chỉ thu nhỏ, giữ tỉ lệ)
+        h, w = frame.shape[:2]
+        r = min(self.display_size[0] / w, self.display_size[1] / h, 1.0)
+        size = max(int(w * r), 1), max(int(h * r), 1)
+        if self.display_bufs is None or self.display_bufs.shape[1:3] != (size[1], size[0]):
+            # hàng đợi output + 1 frame đang hiển thị + 1 frame đang ghi
+            self.display_bufs = np.empty((self.args.queue_size + 2, size[1], size[0], 3), dtype=np.uint8)
+            self.display_index = 0
+        buf = self.display_bufs[self.display_index % len(self.display_bufs)]
+        self.display_index += 1
+        if size != (w, h):
+            cv2.resize(frame, size, dst=buf, interpolation=cv2.INTER_AREA)
+        else:
+            np.copyto(buf, frame)
+        cv2.cvtColor(buf, cv2.COLOR_BGR2RGB, dst=buf)
+        item['image'] = buf
+        return item
+
     def run_detection(self):
-        # Khởi tạo đối tượng đọc video
-        self.cap = cv2.VideoCapture(self.video_path)
-        
-        while self.is_playing:
-            # Đọc từng frame
-            ret, frame = self.cap.read()
-            if not ret:
-                break
-                
-            # Lấy danh sách class được chọn
-            selected_classes = self.get_selected_classes()
-            
-            # Xử lý frame
-            processed_frame = self.process_frame(
-                frame, self.model, self.tracker,
-                self.class_names, self.colors, self.args.conf_thres,
-                selected_classes=selected_classes
-            )
-            
-            # Chuyển đổi frame để hiển thị trong GUI
-            frame_rgb = cv2.cvtColor(processed_frame, cv2.COLOR_BGR2RGB)
-            frame_pil = Image.fromarray(frame_rgb)
-            
-            # Điều chỉnh kích thước frame cho phù hợp với cửa sổ
-            window_width = self.root.winfo_width() - 40
-            window_height = self.root.winfo_height() - 100
-            frame_pil.thumbnail((window_width, window_height))
-            
-            # Hiển thị frame
-            frame_tk = ImageTk.PhotoImage(frame_pil)
-            self.video_frame.configure(image=frame_tk)
-            self.video_frame.image = frame_tk
-            
-            # Cập nhật GUI
-            self.root.update()
-            
-        # Giải phóng video khi kết thúc
-        if self.cap:
-            self.cap.release()
+        self.reset_gating()
+        self.last_render = 0.0  # thời điểm render frame gần nhất
+        
+        def frames():
+            it = self.read_frames()
+            try:
+                for item in it:
+                    item['selected_classes'] = self.selected_classes
+                    yield item
+            finally:
+                it.close()  # giải phóng VideoSource ngay khi pipeline dừng
+        
+        # Mỗi stage chạy trong một thread riêng, nối với nhau bằng hàng đợi có giới hạn
+        self.pipeline = Pipeline(frames(), [
+            ('preprocess', self.preprocess),
+            ('inference', self.inference),
+            ('tracking', self.tracking, 'block'),  # tracker cần đủ frame liên tiếp
+            ('render', self.render)], maxsize=self.args.queue_size, policy=self.args.drop_policy)
+        if self.telemetry:
+            self.stream = Path(self.video_path).name
+            self.telemetry.watch(self.pipeline, self.stream)
+        self.pipeline.start()
+        self.frame_count = 0
+        self.root.after(1, self.update_display)
+
+    def update_display(self):
+        # Hiển thị frame mới nhất trên main thread (Tkinter không an toàn khi gọi từ thread khác)
+        pipeline = self.pipeline
+        if pipeline is None:
+            return
+        self.display_size = (max(self.root.winfo_width() - 40, 1), max(self.root.winfo_height() - 100, 1))
+        item = None
+        while (new := pipeline.get(timeout=0)) is not None:  # chỉ hiển thị frame mới nhất
+            item = new
+            if item is EOS:
+                self.stop_detection()
+                return
+        if item is not None:
+            # Hiển thị frame: chép vào PhotoImage có sẵn thay vì tạo mới
+            im = item['image']
+            h, w = im.shape[:2]
+            if self.photo is None or (self.photo.width(), self.photo.height()) != (w, h):
+                self.photo = ImageTk.PhotoImage('RGB', (w, h))
+                self.video_frame.configure(image=self.photo)
+            self.photo.paste(Image.frombuffer('RGB', (w, h), im, 'raw', 'RGB', 0, 1))
+            self.frame_count += 1
+            if self.args.stats_interval and self.frame_count % self.args.stats_interval == 0:
+                LOGGER.info(f'Pipeline: {pipeline.summary()}')
+        self.root.after(max(int(1000 / self.args.display_fps), 1), self.update_display)
 
     def process_frame(self, frame, model, tracker, class_names, colors, conf_thres, selected_classes=None):
-        # Thực hiện detection trên frame
+        # Thực hiện detection, tracking và vẽ kết quả trên một frame (chạy tuần tự)
         results = model(frame)
         det = results.pred[0]
+        embeds = results.embeds[0] if results.embeds else None
+        tracks = self.update_tracker(frame, det, tracker, class_names, conf_thres, selected_classes, embeds)
+        return self.draw_tracks(frame, tracks, class_names, colors)
+
+    def update_tracker(self, frame, det, tracker, class_names, conf_thres, selected_classes=None, embeds=None):
+        # Lọc detection theo class/độ tin cậy và cập nhật tracker, trả về danh sách tracks
+        if det is None:
+            # Frame giữa các keyframe: chỉ dự đoán Kalman (+ so khớp template với ByteTracker), track mới không bị xóa
+            return tracker.predict(frame)
+        if not len(det):
+            # Keyframe không có detection: mọi track tính là bị mất một lần
+            return tracker.update(np.zeros((0, 6), dtype=np.float32), frame=frame)
         
-        if len(det):
-            detections = []
-            for *xyxy, confidence, class_id in det:
-                try:
-                    class_id = int(class_id)
-                    # Chỉ xử lý class_id 2 và 3 (person và vehicle)
-                    if class_id not in [2, 3]:
-                        continue
-                    
-                    # Lấy tên class và kiểm tra có được chọn không
-                    class_name = class_names[class_id - 2]
-                    if selected_classes and class_name.lower() not in [cls.lower() for cls in selected_classes]:
-                        continue
-                    if confidence < conf_thres:
-                        continue
-                    
-                    # Chuyển đổi tọa độ bounding box
-                    x1, y1, x2, y2 = map(int, xyxy)
-                    detections.append(([x1, y1, x2-x1, y2-y1], confidence, class_id))
-                except Exception as e:
-                    print(f"Lỗi xử lý detection: {e}")
-                    continue
-            
-            # Cập nhật tracker
-            tracks = tracker.update_tracks(detections, frame=frame)
+        # Lọc toàn bộ detection bằng một mask tensor: class được chọn và độ tin cậy
+        class_ids = torch.tensor(self.tracked_class_ids(class_names, selected_classes), device=det.device)
+        mask = (det[:, 5:6] == class_ids).any(1) & (det[:, 4] >= conf_thres)
+        dets = det[mask].cpu().numpy()  # (n,6) [x1, y1, x2, y2, conf, cls]
+        dets[:, :4] = np.trunc(dets[:, :4])  # tọa độ nguyên như trước
+        if embeds is not None:
+            embeds = embeds[mask].cpu().numpy()  # embedding của các detection được giữ lại
+        
+        # Cập nhật tracker với một mảng numpy duy nhất
+        return tracker.update(dets, frame=frame, embeds=embeds)
+
+    @staticmethod
+    def tracked_class_ids(class_names, selected_classes=None):
+        # Chỉ xử lý class_id 2 và 3 (person và vehicle), tên class là class_names[class_id - 2]
+        selected = {cls.lower() for cls in selected_classes} if selected_classes else None
+        return [i + 2 for i, name in enumerate(class_names[:2]) if selected is None or name.lower() in selected]
+
+    def draw_tracks(self, frame, tracks, class_names, colors):
+        # Vẽ các tracks
+        for track in tracks:
+            if not track.is_confirmed():
+                continue
             
-            # Vẽ các tracks
-            for track in tracks:
-                if not track.is_confirmed():
-                    continue
+            try:
+                track_id = track.track_id
+                ltrb = track.to_ltrb()
                 
-                try:
-                    track_id = track.track_id
-                    ltrb = track.to_ltrb()
-                    
-                    # Vẽ bounding box
-                    x1, y1, x2, y2 = map(int, ltrb)
-                    det_class = int(track.get_det_class()) - 2
-                    
-                    if det_class < 0 or det_class >= len(colors):
-                        continue
-                    
-                    color = colors[det_class]
-                    color = (int(color[0]), int(color[1]), int(color[2]))
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                    # Vẽ nhãn
-                    text = f'{class_names[det_class]}-{track_id}'
-                    # Vẽ nhãn với độ chính xác
-                    confidence = track.get_det_conf()
-                    text = f'{class_names[det_class]}-{track_id}({confidence:.2f})'
-                    cv2.putText(frame, text, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
-                except Exception as e:
-                    print(f"Lỗi xử lý track: {e}")
+                # Vẽ bounding box
+                x1, y1, x2, y2 = map(int, ltrb)
+                det_class = int(track.get_det_class()) - 2
+                
+                if det_class < 0 or det_class >= len(colors):
                     continue
                 
+                color = colors[det_class]
+                color = (int(color[0]), int(color[1]), int(color[2]))
+                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+                # Vẽ nhãn
+                text = f'{class_names[det_class]}-{track_id}'
+                # Vẽ nhãn với độ chính xác
+                confidence = track.get_det_conf()  # None khi track chỉ được dự đoán ở frame này
+                if confidence is not None:
+                    text = f'{class_names[det_class]}-{track_id}({confidence:.2f})'
+                cv2.putText(frame, text, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, color, 2)
+            except Exception as e:
+                print(f"Lỗi xử lý track: {e}")
+                continue
+        
         return frame
 
-def main():
+class TrackLog:
+    # Ghi track theo từng frame ra file csv, jsonl hoặc parquet
+    fields = 'frame', 'track_id', 'class_id', 'name', 'conf', 'x1', 'y1', 'x2', 'y2'
+
+    def __init__(self, path, fmt='csv'):
+        assert fmt in ('csv', 'jsonl', 'parquet'), f'Định dạng log không hợp lệ: {fmt}'
+        self.path, self.fmt, self.rows = Path(path).with_suffix(f'.{fmt}'), fmt, []
+        if fmt == 'parquet':
+            check_requirements('pyarrow')
+            self.f = None  # parquet ghi một lần khi đóng
+        else:
+            self.f = open(self.path, 'w', newline='')
+            if fmt == 'csv':
+                self.writer = csv.writer(self.f)
+                self.writer.writerow(self.fields)
+
+    def write(self, rows):
+        if self.fmt == 'csv':
+            self.writer.writerows(rows)
+        elif self.fmt == 'jsonl':
+            self.f.writelines(json.dumps(dict(zip(self.fields, r))) + '\n' for r in rows)
+        else:
+            self.rows.extend(rows)
+
+    def close(self):
+        if self.f:
+            self.f.close()
+        else:
+            import pandas as pd
+            pd.DataFrame(self.rows, columns=self.fields).to_parquet(self.path, index=False)
+
+
+class HeadlessTracker(ObjectDetectionGUI):
+    # Chạy cùng pipeline detection + tracking của GUI nhưng không có Tkinter: ghi video MP4 và log track
+    def __init__(self, args):
+        self.args = args
+        self.selected_classes = args.classes  # None: tất cả class được tracking
+        self.load_detector()
+        self.model.classes = self.tracked_class_ids(self.class_names, self.selected_classes)
+        self.model.conf = self.args.conf_thres
+        self.telemetry, self.stream = None, 'default'
+        if args.metrics_port:
+            worker = current_process()._identity  # (k,) trong process worker thứ k, () trong process chính
+            self.telemetry = Telemetry().serve(args.metrics_port + (worker[0] if worker else 0))
+
+    def track_rows(self, index, tracks):
+        # Một dòng log cho mỗi track đã xác nhận ở frame index
+        rows = []
+        for t in tracks:
+            if not t.is_confirmed():
+                continue
+            c, conf = int(t.get_det_class()), t.get_det_conf()
+            name = self.class_names[c - 2] if 0 <= c - 2 < len(self.class_names) else str(c)
+            x1, y1, x2, y2 = (round(float(x), 1) for x in t.to_ltrb())
+            rows.append((index, t.track_id, c, name, None if conf is None else round(float(conf), 4), x1, y1, x2, y2))
+        return rows
+
+    def write(self, item):
+        # Stage write: vẽ tracks, ghi frame vào video và track vào log
+        frame = self.draw_tracks(item['frame'], item['tracks'], self.class_names, self.colors)
+        if self.writer is not None:
+            self.writer.write(frame)
+        self.log.write(self.track_rows(item['index'], item['tracks']))
+        return {'index': item['index']}  # không giữ frame trong hàng đợi output
+
+    def run(self, source, save_dir):
+        # Xử lý một video, trả về thống kê thông lượng
+        self.tracker = self.new_tracker()  # mỗi video bắt đầu với tracker mới
+        self.reset_gating()
+        hold = 5 * self.args.queue_size + 6  # số frame tối đa đang nằm trong pipeline (4 stage + output)
+        cap = VideoSource(source, self.args.decode_buffer, hold, self.args.decode_size, hw_accel=self.args.hw_decode)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        stem = Path(save_dir) / Path(source).stem
+        self.writer = None if self.args.nosave else \
+            cv2.VideoWriter(str(stem.with_suffix('.mp4')), cv2.VideoWriter_fourcc(*'mp4v'), fps, cap.size)
+        self.log = TrackLog(stem, self.args.log_format)
+        
+        def frames():
+            for i, frame in enumerate(cap):
+                yield {'frame': frame, 'index': i, 'selected_classes': self.selected_classes}
+        
+        # Cùng các stage với GUI, policy 'block' để không bỏ frame nào
+        t = time.perf_counter()
+        pipeline = Pipeline(frames(), [
+            ('preprocess', self.preprocess),
+            ('inference', self.inference),
+            ('tracking', self.tracking),
+            ('write', self.write)], maxsize=self.args.queue_size, policy='block')
+        if self.telemetry:
+            self.stream = Path(source).name
+            self.telemetry.watch(pipeline, self.stream)
+        pipeline.start()
+        n = 0
+        try:
+            while (item := pipeline.get()) is not EOS:
+                n += item is not None
+        finally:
+            pipeline.stop()
+            cap.release()
+            self.log.close()
+            if self.writer is not None:
+                self.writer.release()
+        dt = time.perf_counter() - t
+        LOGGER.info(f'{source}: {n} frames, {dt:.1f}s, {n / max(dt, 1e-9):.1f} FPS ({pipeline.summary()})')
+        return {'source': str(source), 'frames': n, 'seconds': dt, 'fps': n / max(dt, 1e-9)}
+
+
+_worker = None  # HeadlessTracker của mỗi process worker (model chỉ nạp một lần)
+
+
+def track_file(source, args, save_dir):
+    global _worker
+    if _worker is None:
+        _worker = HeadlessTracker(args)
+    return _worker.run(source, save_dir)
+
+
+def run_headless(args):
+    # Xử lý một file video hoặc cả thư mục, song song trên args.workers process
+    source = Path(args.source)
+    files = [source]
+    if source.is_dir():
+        files = sorted(p for p in source.glob('*.*') if p.suffix[1:].lower() in VID_FORMATS)
+    assert files, f'Không tìm thấy video trong {source}'
+    save_dir = increment_path(Path(args.project) / args.name, exist_ok=args.exist_ok, mkdir=True)
+    t = time.perf_counter()
+    if args.workers > 1 and len(files) > 1:
+        # 'spawn' để mỗi worker tự khởi tạo CUDA
+        with ProcessPoolExecutor(min(args.workers, len(files)), mp_context=get_context('spawn')) as pool:
+            results = list(pool.map(track_file, files, [args] * len(files), [save_dir] * len(files)))
+    else:
+        results = [track_file(f, args, save_dir) for f in files]
+    dt = time.perf_counter() - t
+    n = sum(r['frames'] for r in results)
+    LOGGER.info(f'{len(files)} video, {n} frames, {dt:.1f}s: {n / max(dt, 1e-9):.1f} FPS tổng. Kết quả: {save_dir}')
+    return results
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', type=str, default=None, help='video hoặc thư mục video, không có: mở GUI')
+    parser.add_argument('--weights', type=str, default='runs/train/vehicle_person/weights/best.pt', help='model path')
+    parser.add_argument('--data', type=str, default='data.yaml', help='dataset.yaml path')
+    parser.add_argument('--conf-thres', type=float, default=0.5, help='confidence threshold')
+    parser.add_argument('--device', default='', help='cuda device, i.e. 0 or cpu')
+    parser.add_argument('--img-size', type=int, default=640, help='inference size (pixels)')
+    parser.add_argument('--classes', nargs='+', type=str, default=None, help='tên class cần tracking, i.e. person')
+    parser.add_argument('--tracker', default='deepsort', choices=('deepsort', 'bytetrack'), help='tracker')
+    parser.add_argument('--embedder', default='mobilenet', help="DeepSort embedder, 'yolo': đặc trưng neck YOLO")
+    parser.add_argument('--detect-interval', type=int, default=1, help='chạy YOLO mỗi N frame')
+    parser.add_argument('--motion-thres', type=float, default=0.0, help='chạy YOLO sớm khi chuyển động > ngưỡng')
+    parser.add_argument('--queue-size', type=int, default=2, help='số frame tối đa trong hàng đợi của mỗi stage')
+    parser.add_argument('--decode-buffer', type=int, default=4, help='số frame giải mã trước')
+    parser.add_argument('--decode-size', nargs=2, type=int, default=None, help='resize khi giải mã: w h')
+    parser.add_argument('--hw-decode', action='store_true', help='giải mã video bằng phần cứng')
+    parser.add_argument('--tile', type=int, default=0, help='kích thước tile (pixels), 0: không chia tile')
+    parser.add_argument('--tile-overlap', type=float, default=0.2, help='tỉ lệ chồng lấn giữa các tile')
+    parser.add_argument('--roi', dest='rois', nargs=4, type=int, action='append', help='vùng detect: x1 y1 x2 y2')
+    parser.add_argument('--motion-gate', default=None, choices=('mog2', 'diff'), help='motion gate')
+    parser.add_argument('--metrics-port', type=int, default=0, help='cổng Prometheus /metrics, worker k dùng port+k')
+    parser.add_argument('--ort-threads', type=int, default=0, help='số thread ONNX Runtime mỗi worker, 0: mặc định')
+    parser.add_argument('--ov-hint', default='LATENCY', choices=('LATENCY', 'THROUGHPUT'), help='OpenVINO hint')
+    parser.add_argument('--log-format', default='csv', choices=('csv', 'jsonl', 'parquet'), help='định dạng log track')
+    parser.add_argument('--nosave', action='store_true', help='không ghi video MP4')
+    parser.add_argument('--workers', type=int, default=1, help='số process xử lý song song nhiều file')
+    parser.add_argument('--project', default='runs/track', help='save results to project/name')
+    parser.add_argument('--name', default='exp', help='save results to project/name')
+    parser.add_argument('--exist-ok', action='store_true', help='existing project/name ok, do not increment')
+    opt = parser.parse_args()
+    if opt.source:
+        print_args(vars(opt))
+    return opt
+
+
+def main(opt=None):
+    if opt is not None and opt.source:
+        run_headless(opt)  # chế độ headless
+        return
     # Khởi tạo cửa sổ chính
     root = tk.Tk()
     app = ObjectDetectionGUI(root)
@@ -249,4 +613,4 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main(parse_opt())
\ No newline at end of file
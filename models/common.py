@@ -1,12 +1,17 @@
 import ast
+import asyncio
 import contextlib
 import json
 import math
 import platform
+import queue
+import threading
 import warnings
 import zipfile
 from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from copy import copy
+from functools import cached_property
 from pathlib import Path
 from urllib.parse import urlparse
 
@@ -16,12 +21,14 @@ import pandas as pd
 import requests
 import torch
 import torch.nn as nn
+import torchvision
 from IPython.display import display
 from PIL import Image
 from torch.cuda import amp
 
 from utils import TryExcept
-from utils.dataloaders import exif_transpose, letterbox
+from utils.augmentations import letterbox_into
+from utils.dataloaders import exif_transpose
 from utils.general import (LOGGER, ROOT, Profile, check_requirements, check_suffix, check_version, colorstr,
                            increment_path, is_notebook, make_divisible, non_max_suppression, scale_boxes,
                            xywh2xyxy, xyxy2xywh, yaml_load)
@@ -672,7 +679,34 @@ class CBFuse(nn.Module):
 
 class DetectMultiBackend(nn.Module):
     # YOLO MultiBackend class for python inference on various backends
-    def __init__(self, weights='yolo.pt', device=torch.device('cpu'), dnn=False, data=None, fp16=False, fuse=True):
+    ORT_OPTS = {
+        'intra_op_threads': 0,  # threads inside an operator, 0 = one per physical core
+        'inter_op_threads': 0,  # threads across operators, execution_mode='parallel' only
+        'execution_mode': 'sequential',  # 'sequential' or 'parallel'
+        'spinning': True,  # busy-wait intra-op threads, lower latency at the cost of idle CPU
+        'cache': True,  # save the optimized graph as *.cpu.ort.onnx and reuse it on later startups
+        'io_binding': True,  # bind input and preallocated outputs instead of session.run() allocations
+    }
+    OV_OPTS = {
+        'device': 'CPU',  # OpenVINO device, i.e. 'GPU', 'AUTO' or 'MULTI:CPU,GPU'
+        'hint': 'LATENCY',  # 'LATENCY', 'THROUGHPUT' or 'CUMULATIVE_THROUGHPUT' performance hint
+        'streams': 0,  # parallel inference streams, 0 = chosen by the hint
+        'threads': 0,  # inference threads, 0 = all cores
+        'requests': 0,  # submit() infer requests in flight, 0 = optimal number for the compiled model
+        'cache_dir': '',  # compiled model cache directory, '' = no caching
+    }
+
+    def __init__(self,
+                 weights='yolo.pt',
+                 device=torch.device('cpu'),
+                 dnn=False,
+                 data=None,
+                 fp16=False,
+                 fuse=True,
+                 prune=True,
+                 slots=2,
+                 ort_opts=None,
+                 ov_opts=None):
         # Usage:
         #   PyTorch:              weights = *.pt
         #   TorchScript:                    *.torchscript
@@ -686,6 +720,9 @@ class DetectMultiBackend(nn.Module):
         #   TensorFlow Lite:                *.tflite
         #   TensorFlow Edge TPU:            *_edgetpu.tflite
         #   PaddlePaddle:                   *_paddle_model
+        # prune: PyTorch dual-head models run the main branch only, see BaseModel.prune_aux()
+        # ort_opts: ONNX Runtime options dict, i.e. {'intra_op_threads': 4}, see ORT_OPTS
+        # ov_opts: OpenVINO options dict, i.e. {'hint': 'THROUGHPUT'}, see OV_OPTS
         from models.experimental import attempt_download, attempt_load  # scoped to avoid circular import
 
         super().__init__()
@@ -699,7 +736,11 @@ class DetectMultiBackend(nn.Module):
             w = attempt_download(w)  # download if not local
 
         if pt:  # PyTorch
-            model = attempt_load(weights if isinstance(weights, list) else w, device=device, inplace=True, fuse=fuse)
+            model = attempt_load(weights if isinstance(weights, list) else w,
+                                 device=device,
+                                 inplace=True,
+                                 fuse=fuse,
+                                 prune=prune)
             stride = max(int(model.stride.max()), 32)  # model stride
             names = model.module.names if hasattr(model, 'module') else model.names  # get class names
             model.half() if fp16 else model.float()
@@ -723,7 +764,24 @@ class DetectMultiBackend(nn.Module):
             check_requirements(('onnx', 'onnxruntime-gpu' if cuda else 'onnxruntime'))
             import onnxruntime
             providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if cuda else ['CPUExecutionProvider']
-            session = onnxruntime.InferenceSession(w, providers=providers)
+            ort_opts = {**self.ORT_OPTS, **(ort_opts or {})}
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = ort_opts['intra_op_threads']
+            session_options.inter_op_num_threads = ort_opts['inter_op_threads']
+            session_options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL if ort_opts[
+                'execution_mode'] == 'parallel' else onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+            session_options.add_session_config_entry('session.intra_op.allow_spinning', str(int(ort_opts['spinning'])))
+            ort_cache = Path(w).with_suffix(f".{'cuda' if cuda else 'cpu'}.ort.onnx")  # optimized graph
+            f = w
+            if ort_opts['cache'] and ort_cache.exists() and ort_cache.stat().st_mtime >= Path(w).stat().st_mtime:
+                LOGGER.info(f'Using optimized graph {ort_cache}')
+                f = str(ort_cache)
+                session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+            elif ort_opts['cache']:
+                session_options.optimized_model_filepath = str(ort_cache)  # saved for the next startup
+            session = onnxruntime.InferenceSession(f, session_options, providers=providers)
+            io_binding = ort_opts['io_binding']
+            ort_buffers = {}  # preallocated IO binding outputs, see _ort_run()
             output_names = [x.name for x in session.get_outputs()]
             meta = session.get_modelmeta().custom_metadata_map  # metadata
             if 'stride' in meta:
@@ -731,8 +789,11 @@ class DetectMultiBackend(nn.Module):
         elif xml:  # OpenVINO
             LOGGER.info(f'Loading {w} for OpenVINO inference...')
             check_requirements('openvino')  # requires openvino-dev: https://pypi.org/project/openvino-dev/
-            from openvino.runtime import Core, Layout, get_batch
+            from openvino.runtime import AsyncInferQueue, Core, Layout, get_batch
+            ov_opts = {**self.OV_OPTS, **(ov_opts or {})}
             ie = Core()
+            if ov_opts['cache_dir']:
+                ie.set_property({'CACHE_DIR': str(ov_opts['cache_dir'])})  # skip compilation on later startups
             if not Path(w).is_file():  # if not *.xml
                 w = next(Path(w).glob('*.xml'))  # get *.xml file from *_openvino_model dir
             network = ie.read_model(model=w, weights=Path(w).with_suffix('.bin'))
@@ -741,7 +802,16 @@ class DetectMultiBackend(nn.Module):
             batch_dim = get_batch(network)
             if batch_dim.is_static:
                 batch_size = batch_dim.get_length()
-            executable_network = ie.compile_model(network, device_name="CPU")  # device_name="MYRIAD" for Intel NCS2
+            ov_config = {'PERFORMANCE_HINT': ov_opts['hint']}
+            if ov_opts['streams']:
+                ov_config['NUM_STREAMS'] = str(ov_opts['streams'])
+            if ov_opts['threads']:
+                ov_config['INFERENCE_NUM_THREADS'] = str(ov_opts['threads'])
+            executable_network = ie.compile_model(network, device_name=ov_opts['device'], config=ov_config)
+            ov_requests = ov_opts['requests'] or executable_network.get_property('OPTIMAL_NUMBER_OF_INFER_REQUESTS')
+            ov_queue = AsyncInferQueue(executable_network, ov_requests)  # submit() infer request pool
+            ov_queue.set_callback(self._ov_done)
+            LOGGER.info(f"OpenVINO {ov_opts['device']} {ov_opts['hint']}: {ov_requests} infer requests")
             stride, names = self._load_metadata(Path(w).with_suffix('.yaml'))  # load metadata
         elif engine:  # TensorRT
             LOGGER.info(f'Loading {w} for TensorRT inference...')
@@ -859,6 +929,8 @@ class DetectMultiBackend(nn.Module):
             names = yaml_load(ROOT / 'data/ImageNet.yaml')['names']  # human-readable names
 
         self.__dict__.update(locals())  # assign all variables to self
+        self.executor = None  # submit() thread pool, created on first use
+        self.executor_lock = threading.Lock()
 
     def forward(self, im, augment=False, visualize=False):
         # YOLO MultiBackend inference
@@ -877,8 +949,11 @@ class DetectMultiBackend(nn.Module):
             self.net.setInput(im)
             y = self.net.forward()
         elif self.onnx:  # ONNX Runtime
-            im = im.cpu().numpy()  # torch to numpy
-            y = self.session.run(self.output_names, {self.session.get_inputs()[0].name: im})
+            if self.io_binding:
+                y = self._ort_run(im)
+            else:
+                im = im.cpu().numpy()  # torch to numpy
+                y = self.session.run(self.output_names, {self.session.get_inputs()[0].name: im})
         elif self.xml:  # OpenVINO
             im = im.cpu().numpy()  # FP32
             y = list(self.executable_network([im]).values())
@@ -945,6 +1020,89 @@ class DetectMultiBackend(nn.Module):
     def from_numpy(self, x):
         return torch.from_numpy(x).to(self.device) if isinstance(x, np.ndarray) else x
 
+    def _ort_run(self, im):
+        # ONNX Runtime inference with IO binding. The input tensor is bound in place and outputs are written into
+        # buffers preallocated per thread and input shape, which the next call from the same thread overwrites
+        im = im.to(self.device if self.cuda else 'cpu').contiguous()
+        name = self.session.get_inputs()[0].name
+        key = threading.get_ident(), tuple(im.shape), im.dtype
+        out = self.ort_buffers.get(key)
+        if out is None:  # first call at this shape, outputs allocated by ONNX Runtime give the buffer shapes
+            y = self.session.run(self.output_names, {name: im.cpu().numpy()})
+            if len(self.ort_buffers) > 16:
+                self.ort_buffers.clear()
+            self.ort_buffers[key] = [(torch.empty(x.shape, dtype=torch.from_numpy(x).dtype, device=im.device), x.dtype)
+                                     for x in y]
+            return y
+        d, i = im.device.type, im.device.index or 0
+        binding = self.session.io_binding()
+        binding.bind_input(name, d, i, torch.empty(0, dtype=im.dtype).numpy().dtype, tuple(im.shape), im.data_ptr())
+        for n, (x, dtype) in zip(self.output_names, out):
+            binding.bind_output(n, d, i, dtype, tuple(x.shape), x.data_ptr())
+        if im.is_cuda:
+            torch.cuda.current_stream(im.device).synchronize()  # input written by torch before ONNX Runtime reads it
+        self.session.run_with_iobinding(binding)
+        return [x for x, _ in out]
+
+    def _ov_done(self, request, future):
+        # OpenVINO AsyncInferQueue callback, copies the outputs out of the request before it is reused
+        try:
+            y = [self.from_numpy(t.data.copy()) for t in request.output_tensors]
+            future.set_result(y[0] if len(y) == 1 else y)
+        except Exception as e:
+            future.set_exception(e)
+
+    def submit(self, im, augment=False, visualize=False):
+        # Asynchronous forward(), returns a concurrent.futures.Future of the outputs, i.e. model.submit(im).result()
+        # Up to `slots` inferences are in flight, so preprocessing of the next batch overlaps this one. PyTorch CUDA
+        # slots run on their own streams, backends whose sessions are not thread-safe run one at a time. PyTorch
+        # forwards also run one at a time (modules and hooks keep per-call state), the lock only serializes kernel
+        # launches and the GPU work of the slots still overlaps. OpenVINO uses its own infer request pool instead and
+        # blocks while all requests are busy
+        if self.xml:
+            future = Future()
+            self.ov_queue.start_async({0: im.cpu().numpy()}, future)
+            return future
+        if self.executor is None:
+            with self.executor_lock:
+                if self.executor is None:
+                    safe = self.jit or (self.onnx and not self.dnn) or self.triton  # thread-safe, cv2.dnn.Net is not
+                    self.lock = contextlib.nullcontext() if safe else threading.Lock()
+                    self.streams = None  # free CUDA streams, one per slot
+                    if (self.pt or self.jit) and self.device.type == 'cuda':
+                        self.streams = queue.SimpleQueue()
+                        for _ in range(self.slots):
+                            self.streams.put(torch.cuda.Stream(self.device))
+                    self.executor = ThreadPoolExecutor(max(self.slots, 1), thread_name_prefix='dmb')  # set last
+        event = None
+        if isinstance(im, torch.Tensor) and im.is_cuda:
+            event = torch.cuda.Event()
+            event.record()  # input is ready once the caller's stream reaches this point
+        return self.executor.submit(self._infer, im, event, augment, visualize)
+
+    async def asubmit(self, im, augment=False, visualize=False):
+        # asyncio variant of submit(), i.e. y = await model.asubmit(im)
+        return await asyncio.wrap_future(self.submit(im, augment, visualize))
+
+    @smart_inference_mode()
+    def _infer(self, im, event, augment, visualize):
+        # One submit() slot, runs in the executor thread
+        s = self.streams.get() if self.streams else None
+        try:
+            with self.lock, torch.cuda.stream(s):  # stream(None) is a no-op
+                if s and event:
+                    s.wait_event(event)
+                    im.record_stream(s)  # do not reuse the input memory before this stream is done with it
+                y = self.forward(im, augment, visualize)
+                if self.engine or (self.onnx and not self.dnn and self.io_binding):  # shared output buffers
+                    y = [x.clone() for x in y] if isinstance(y, list) else y.clone()
+            if s:
+                s.synchronize()
+            return y
+        finally:
+            if s:
+                self.streams.put(s)
+
     def warmup(self, imgsz=(1, 3, 640, 640)):
         # Warmup model by running inference once
         warmup_types = self.pt, self.jit, self.onnx, self.engine, self.saved_model, self.pb, self.triton
@@ -985,7 +1143,12 @@ class AutoShape(nn.Module):
     multi_label = False  # NMS multiple labels per box
     classes = None  # (optional list) filter by class, i.e. = [0, 15, 16] for COCO persons, cats and dogs
     max_det = 1000  # maximum number of detections per image
+    topk = None  # (optional int) maximum NMS candidates per image, i.e. 3000 at low conf
+    topk_per_class = None  # (optional int) maximum NMS candidates per class and image
+    nms = 'greedy'  # NMS engine 'greedy', 'matrix', 'cluster' or 'soft', see utils/nms.py
     amp = False  # Automatic Mixed Precision (AMP) inference
+    embed = False  # return ROI-pooled neck feature embeddings with detections (PyTorch models only)
+    pin = True  # letterbox into page-locked host buffers for asynchronous host-to-device copies (CUDA only)
 
     def __init__(self, model, verbose=True):
         super().__init__()
@@ -999,6 +1162,10 @@ class AutoShape(nn.Module):
             m = self.model.model.model[-1] if self.dmb else self.model.model[-1]  # Detect()
             m.inplace = False  # Detect.inplace=False for safe multithread inference
             m.export = True  # do not output loss values
+            m.register_forward_pre_hook(self._capture)  # neck features for embed=True
+        self.feats = None  # last captured neck feature maps
+        self.inputs = {}  # reusable uint8 BHWC input buffers by thread and shape, see input_buffer()
+        self.inputs_lock = threading.Lock()
 
     def _apply(self, fn):
         # Apply to(), cpu(), cuda(), half() to model tensors that are not parameters or registered buffers
@@ -1012,6 +1179,11 @@ class AutoShape(nn.Module):
                     setattr(m, k, list(map(fn, x))) if isinstance(x, (list, tuple)) else setattr(m, k, fn(x))
         return self
 
+    def _capture(self, m, inputs):
+        # Detect() forward pre-hook, keeps the P3-P5 inputs of the (main branch of the) head
+        if self.embed:
+            self.feats = inputs[0][-m.nl:], m.stride
+
     @smart_inference_mode()
     def forward(self, ims, size=640, augment=False, profile=False):
         # Inference from various sources. For size(height=640, width=1280), RGB images example inputs are:
@@ -1025,37 +1197,12 @@ class AutoShape(nn.Module):
 
         dt = (Profile(), Profile(), Profile())
         with dt[0]:
-            if isinstance(size, int):  # expand
-                size = (size, size)
             p = next(self.model.parameters()) if self.pt else torch.empty(1, device=self.model.device)  # param
             autocast = self.amp and (p.device.type != 'cpu')  # Automatic Mixed Precision (AMP) inference
             if isinstance(ims, torch.Tensor):  # torch
                 with amp.autocast(autocast):
                     return self.model(ims.to(p.device).type_as(p), augment=augment)  # inference
-
-            # Pre-process
-            n, ims = (len(ims), list(ims)) if isinstance(ims, (list, tuple)) else (1, [ims])  # number, list of images
-            shape0, shape1, files = [], [], []  # image and inference shapes, filenames
-            for i, im in enumerate(ims):
-                f = f'image{i}'  # filename
-                if isinstance(im, (str, Path)):  # filename or uri
-                    im, f = Image.open(requests.get(im, stream=True).raw if str(im).startswith('http') else im), im
-                    im = np.asarray(exif_transpose(im))
-                elif isinstance(im, Image.Image):  # PIL Image
-                    im, f = np.asarray(exif_transpose(im)), getattr(im, 'filename', f) or f
-                files.append(Path(f).with_suffix('.jpg').name)
-                if im.shape[0] < 5:  # image in CHW
-                    im = im.transpose((1, 2, 0))  # reverse dataloader .transpose(2, 0, 1)
-                im = im[..., :3] if im.ndim == 3 else cv2.cvtColor(im, cv2.COLOR_GRAY2BGR)  # enforce 3ch input
-                s = im.shape[:2]  # HWC
-                shape0.append(s)  # image shape
-                g = max(size) / max(s)  # gain
-                shape1.append([int(y * g) for y in s])
-                ims[i] = im if im.data.contiguous else np.ascontiguousarray(im)  # update
-            shape1 = [make_divisible(x, self.stride) for x in np.array(shape1).max(0)]  # inf shape
-            x = [letterbox(im, shape1, auto=False)[0] for im in ims]  # pad
-            x = np.ascontiguousarray(np.array(x).transpose((0, 3, 1, 2)))  # stack and BHWC to BCHW
-            x = torch.from_numpy(x).to(p.device).type_as(p) / 255  # uint8 to fp16/32
+            x, ims, files, shape0, shape1 = self.preprocess(ims, size)  # pre-process
 
         with amp.autocast(autocast):
             # Inference
@@ -1064,37 +1211,135 @@ class AutoShape(nn.Module):
 
             # Post-process
             with dt[2]:
-                y = non_max_suppression(y if self.dmb else y[0],
-                                        self.conf,
-                                        self.iou,
-                                        self.classes,
-                                        self.agnostic,
-                                        self.multi_label,
-                                        max_det=self.max_det)  # NMS
-                for i in range(n):
-                    scale_boxes(shape1, y[i][:, :4], shape0[i])
-
-            return Detections(ims, y, files, dt, self.names, x.shape)
+                e = None
+                if self.embed:
+                    y, e = self.postprocess(y, shape0, shape1, embed=True)  # NMS and embeddings
+                else:
+                    y = self.postprocess(y, shape0, shape1)  # NMS
+
+            return Detections(ims, y, files, dt, self.names, x.shape, e)
+
+    def preprocess(self, ims, size=640):
+        # Pre-process cv2/np/PIL/file inputs to a normalized BCHW tensor on the model device
+        # Returns x, ims (list of HWC numpy images), files, shape0 (image shapes), shape1 (inference shape)
+        if isinstance(size, int):  # expand
+            size = (size, size)
+        p = next(self.model.parameters()) if self.pt else torch.empty(1, device=self.model.device)  # param
+        n, ims = (len(ims), list(ims)) if isinstance(ims, (list, tuple)) else (1, [ims])  # number, list of images
+        shape0, shape1, files = [], [], []  # image and inference shapes, filenames
+        for i, im in enumerate(ims):
+            f = f'image{i}'  # filename
+            if isinstance(im, (str, Path)):  # filename or uri
+                im, f = Image.open(requests.get(im, stream=True).raw if str(im).startswith('http') else im), im
+                im = np.asarray(exif_transpose(im))
+            elif isinstance(im, Image.Image):  # PIL Image
+                im, f = np.asarray(exif_transpose(im)), getattr(im, 'filename', f) or f
+            files.append(Path(f).with_suffix('.jpg').name)
+            if im.shape[0] < 5:  # image in CHW
+                im = im.transpose((1, 2, 0))  # reverse dataloader .transpose(2, 0, 1)
+            im = im[..., :3] if im.ndim == 3 else cv2.cvtColor(im, cv2.COLOR_GRAY2BGR)  # enforce 3ch input
+            s = im.shape[:2]  # HWC
+            shape0.append(s)  # image shape
+            g = max(size) / max(s)  # gain
+            shape1.append([int(y * g) for y in s])
+            ims[i] = im if im.data.contiguous else np.ascontiguousarray(im)  # update
+        shape1 = [make_divisible(x, self.stride) for x in np.array(shape1).max(0)]  # inf shape
+        buf = self.input_buffer((n, *shape1, 3), p.device)
+        for i, im in enumerate(ims):
+            letterbox_into(im, buf[0][i].numpy())  # pad straight into the batch buffer
+        x = torch.empty((n, 3, *shape1), dtype=p.dtype, device=p.device)
+        torch.div(buf[0].to(p.device, non_blocking=True).permute(0, 3, 1, 2), 255, out=x)  # BHWC to BCHW, cast, 0-1
+        if buf[0].is_pinned():
+            buf[1] = torch.cuda.Event()
+            buf[1].record()  # slot is free once the asynchronous copy has completed
+        return x, ims, files, shape0, shape1
+
+    def input_buffer(self, shape, device, n=2):
+        # Reusable uint8 BHWC host buffer for shape, as a [tensor, event] slot of a ring of n per shape so that a
+        # buffer is never overwritten while its asynchronous host-to-device copy is still in flight. Each calling
+        # thread has its own rings, i.e. main.py preprocess and tiled_inference stages never share a slot
+        k = threading.get_ident(), shape
+        with self.inputs_lock:
+            ring = self.inputs.get(k)
+            if ring is None:
+                if len(self.inputs) >= 8:  # input shapes keep changing, drop old buffers
+                    self.inputs.clear()
+                pin = self.pin and device.type == 'cuda'
+                ring = self.inputs[k] = [[torch.empty(shape, dtype=torch.uint8, pin_memory=pin), None]
+                                         for _ in range(n)]
+        buf = ring.pop(0)
+        ring.append(buf)  # round robin, the ring is only used by this thread
+        if buf[1] is not None:
+            buf[1].synchronize()  # wait for the previous copy from this slot
+            buf[1] = None
+        return buf
+
+    def postprocess(self, y, shape0, shape1, embed=False):
+        # NMS and rescale boxes from inference shape1 to image shapes shape0, returns list of (n,6) tensors
+        # embed=True also returns a list of (n,c) L2-normalized embeddings pooled from the captured neck features
+        y = non_max_suppression(y if self.dmb else y[0],
+                                self.conf,
+                                self.iou,
+                                self.classes,
+                                self.agnostic,
+                                self.multi_label,
+                                max_det=self.max_det,
+                                topk=self.topk,
+                                topk_per_class=self.topk_per_class,
+                                engine=self.nms)  # NMS
+        e = self.roi_embed([x[:, :4] for x in y]) if embed else None  # boxes still in inference coordinates
+        for i in range(len(shape0)):
+            scale_boxes(shape1, y[i][:, :4], shape0[i])
+        return (y, e) if embed else y
+
+    def roi_embed(self, boxes):
+        # ROI-align each xyxy box (list of (n,4) per image) on every captured feature level, concat levels and normalize
+        assert self.feats is not None, 'No neck features captured, embed=True requires a PyTorch model'
+        (feats, stride), self.feats = self.feats, None
+        rois = [b.float() for b in boxes]
+        e = [
+            torchvision.ops.roi_align(f.float(), rois, 1, spatial_scale=1 / float(s), sampling_ratio=2, aligned=True)
+            for f, s in zip(feats, stride)]  # (n,c,1,1) per level
+        e = nn.functional.normalize(torch.cat(e, 1).flatten(1), dim=1)
+        return list(e.split([len(b) for b in boxes]))
 
 
 class Detections:
     # YOLO detections class for inference results
-    def __init__(self, ims, pred, files, times=(0, 0, 0), names=None, shape=None):
+    # xywh, xyxyn and xywhn are computed on first access and cached, most callers only read pred
+    columns_xyxy = 'xmin', 'ymin', 'xmax', 'ymax', 'confidence', 'class'
+    columns_xywh = 'xcenter', 'ycenter', 'width', 'height', 'confidence', 'class'
+
+    def __init__(self, ims, pred, files, times=(0, 0, 0), names=None, shape=None, embeds=None):
         super().__init__()
-        d = pred[0].device  # device
-        gn = [torch.tensor([*(im.shape[i] for i in [1, 0, 1, 0]), 1, 1], device=d) for im in ims]  # normalizations
         self.ims = ims  # list of images as numpy arrays
         self.pred = pred  # list of tensors pred[0] = (xyxy, conf, cls)
         self.names = names  # class names
         self.files = files  # image filenames
         self.times = times  # profiling times
         self.xyxy = pred  # xyxy pixels
-        self.xywh = [xyxy2xywh(x) for x in pred]  # xywh pixels
-        self.xyxyn = [x / g for x, g in zip(self.xyxy, gn)]  # xyxy normalized
-        self.xywhn = [x / g for x, g in zip(self.xywh, gn)]  # xywh normalized
         self.n = len(self.pred)  # number of images (batch size)
         self.t = tuple(x.t / self.n * 1E3 for x in times)  # timestamps (ms)
         self.s = tuple(shape)  # inference BCHW shape
+        self.embeds = embeds  # list of (n,c) appearance embeddings per image, AutoShape.embed=True only
+
+    @cached_property
+    def gn(self):
+        # normalization gains per image
+        return [torch.tensor([*(im.shape[i] for i in [1, 0, 1, 0]), 1, 1], device=x.device) for im, x in
+                zip(self.ims, self.pred)]
+
+    @cached_property
+    def xywh(self):
+        return [xyxy2xywh(x) for x in self.pred]  # xywh pixels
+
+    @cached_property
+    def xyxyn(self):
+        return [x / g for x, g in zip(self.xyxy, self.gn)]  # xyxy normalized
+
+    @cached_property
+    def xywhn(self):
+        return [x / g for x, g in zip(self.xywh, self.gn)]  # xywh normalized
 
     def _run(self, pprint=False, show=False, save=False, crop=False, render=False, labels=True, save_dir=Path('')):
         s, crops = '', []
@@ -1157,20 +1402,51 @@ class Detections:
         self._run(render=True, labels=labels)  # render results
         return self.ims
 
+    def _names(self):
+        # class names as a numpy array indexable by class
+        return np.array([self.names[i] for i in range(len(self.names))])
+
     def pandas(self):
         # return detections as pandas DataFrames, i.e. print(results.pandas().xyxy[0])
         new = copy(self)  # return copy
-        ca = 'xmin', 'ymin', 'xmax', 'ymax', 'confidence', 'class', 'name'  # xyxy columns
-        cb = 'xcenter', 'ycenter', 'width', 'height', 'confidence', 'class', 'name'  # xywh columns
-        for k, c in zip(['xyxy', 'xyxyn', 'xywh', 'xywhn'], [ca, ca, cb, cb]):
-            a = [[x[:5] + [int(x[5]), self.names[int(x[5])]] for x in x.tolist()] for x in getattr(self, k)]  # update
-            setattr(new, k, [pd.DataFrame(x, columns=c) for x in a])
+        names = self._names()
+        for k in 'xyxy', 'xyxyn', 'xywh', 'xywhn':
+            c = self.columns_xywh if k.startswith('xywh') else self.columns_xyxy
+            dfs = []
+            for a in self.numpy(k):  # built from columns, not row by row
+                d = {x: a[x] for x in c[:5]}
+                d['class'] = a['class'].astype(int)
+                d['name'] = names[d['class']]
+                dfs.append(pd.DataFrame(d, columns=[*c, 'name']))
+            setattr(new, k, dfs)
         return new
 
+    def numpy(self, fmt='xyxy'):
+        # return detections as numpy structured arrays, one per image, i.e. results.numpy()[0]['confidence']
+        # zero-copy views of the results if they are already float32 on CPU
+        c = self.columns_xywh if fmt.startswith('xywh') else self.columns_xyxy
+        dtype = np.dtype([(x, np.float32) for x in c])
+        return [np.ascontiguousarray(x.cpu().float().numpy()).view(dtype)[:, 0] for x in getattr(self, fmt)]
+
+    def arrow(self, fmt='xyxy'):
+        # return detections of all images as one pyarrow Table with an 'image' column, i.e. results.arrow().to_pandas()
+        check_requirements('pyarrow')
+        import pyarrow as pa
+
+        c = self.columns_xywh if fmt.startswith('xywh') else self.columns_xyxy
+        x = torch.cat(getattr(self, fmt)).cpu().float().numpy()
+        image = np.repeat(np.arange(self.n, dtype=np.int32), [len(p) for p in self.pred])
+        cls = x[:, 5].astype(np.int32)
+        cols = {'image': image, **{k: x[:, i] for i, k in enumerate(c[:5])}, 'class': cls}
+        cols['name'] = pa.DictionaryArray.from_arrays(cls, pa.array(self._names()))
+        return pa.table(cols)
+
     def tolist(self):
         # return a list of Detections objects, i.e. 'for result in results.tolist():'
         r = range(self.n)  # iterable
-        x = [Detections([self.ims[i]], [self.pred[i]], [self.files[i]], self.times, self.names, self.s) for i in r]
+        x = [
+            Detections([self.ims[i]], [self.pred[i]], [self.files[i]], self.times, self.names, self.s,
+                       [self.embeds[i]] if self.embeds else None) for i in r]
         # for d in x:
         #    for k in ['ims', 'pred', 'xyxy', 'xyxyn', 'xywh', 'xywhn']:
         #        setattr(d, k, getattr(d, k)[0])  # pop out of list
@@ -5,6 +5,7 @@ import torch
 import torch.nn as nn
 
 from utils.downloads import attempt_download
+from utils.tal.anchor_generator import AnchorCache
 
 
 class Sum(nn.Module):
@@ -216,16 +217,58 @@ class ONNX_TRT(nn.Module):
                                                                     self.score_threshold)
         return num_det, det_boxes, det_scores, det_classes
 
+class ONNX_DENSE(nn.Module):
+    '''onnx module with Matrix-NMS or Cluster-NMS in plain tensor ops, no NMS plugin required.'''
+    def __init__(self, max_obj=100, iou_thres=0.45, score_thres=0.25, max_wh=None, device=None, n_classes=80,
+                 engine='matrix', max_k=1000, iters=4):
+        super().__init__()
+        assert engine in ('matrix', 'cluster'), f'ONNX export supports matrix or cluster NMS, not {engine}'
+        self.device = device if device else torch.device('cpu')
+        self.max_obj = max_obj
+        self.iou_threshold = iou_thres
+        self.score_threshold = score_thres
+        self.max_wh = 7680 if max_wh is None else max_wh  # class offset, 0 for class-agnostic NMS
+        self.engine = engine
+        self.max_k = max_k  # candidates per image into NMS
+        self.iters = iters  # Cluster-NMS iterations, unrolled in the graph
+        self.convert_matrix = torch.tensor([[1, 0, 1, 0], [0, 1, 0, 1], [-0.5, 0, 0.5, 0], [0, -0.5, 0, 0.5]],
+                                           dtype=torch.float32,
+                                           device=self.device)
+        self.n_classes = n_classes
+
+    def forward(self, x):
+        from utils.nms import ENGINES
+
+        if isinstance(x, list):  # dual heads, main branch
+            x = x[1]
+        x = x.permute(0, 2, 1)
+        boxes = x[..., :4] @ self.convert_matrix  # xywh to xyxy
+        score, cls = x[..., 4:].max(2)
+        score, i = score.topk(min(self.max_k, score.shape[1]), 1)  # top-k candidates
+        boxes, cls = boxes.gather(1, i[..., None].expand(-1, -1, 4)), cls.gather(1, i)
+        kwargs = {'iters': self.iters} if self.engine == 'cluster' else {}
+        score = ENGINES[self.engine](boxes + cls[..., None].float() * self.max_wh, score, self.iou_threshold, **kwargs)
+        score = score * (score > self.score_threshold)
+        det_scores, j = score.topk(self.max_obj, 1)
+        det_boxes, det_classes = boxes.gather(1, j[..., None].expand(-1, -1, 4)), cls.gather(1, j)
+        num_det = (det_scores > self.score_threshold).sum(1, keepdim=True).int()
+        return num_det, det_boxes, det_scores, det_classes.int()
+
+
 class End2End(nn.Module):
     '''export onnx or tensorrt model with NMS operation.'''
-    def __init__(self, model, max_obj=100, iou_thres=0.45, score_thres=0.25, max_wh=None, device=None, n_classes=80):
+    def __init__(self, model, max_obj=100, iou_thres=0.45, score_thres=0.25, max_wh=None, device=None, n_classes=80,
+                 engine='greedy'):
         super().__init__()
         device = device if device else torch.device('cpu')
         assert isinstance(max_wh,(int)) or max_wh is None
         self.model = model.to(device)
         self.model.model[-1].end2end = True
-        self.patch_model = ONNX_TRT if max_wh is None else ONNX_ORT
-        self.end2end = self.patch_model(max_obj, iou_thres, score_thres, max_wh, device, n_classes)
+        if engine != 'greedy':  # NMS in plain ONNX ops
+            self.end2end = ONNX_DENSE(max_obj, iou_thres, score_thres, max_wh, device, n_classes, engine)
+        else:
+            self.patch_model = ONNX_TRT if max_wh is None else ONNX_ORT
+            self.end2end = self.patch_model(max_obj, iou_thres, score_thres, max_wh, device, n_classes)
         self.end2end.eval()
 
     def forward(self, x):
@@ -234,9 +277,10 @@ class End2End(nn.Module):
         return x
 
 
-def attempt_load(weights, device=None, inplace=True, fuse=True):
+def attempt_load(weights, device=None, inplace=True, fuse=True, prune=False):
     # Loads an ensemble of models weights=[a,b,c] or a single model weights=[a] or weights=a
-    from models.yolo import Detect, Model
+    # prune=True drops the auxiliary branch of dual-head models for inference, see BaseModel.prune_aux()
+    from models.yolo import DDetect, Detect, DualDDetect, DualDetect, Model, TripleDDetect, TripleDetect
 
     model = Ensemble()
     for w in weights if isinstance(weights, list) else [weights]:
@@ -248,6 +292,8 @@ def attempt_load(weights, device=None, inplace=True, fuse=True):
             ckpt.stride = torch.tensor([32.])
         if hasattr(ckpt, 'names') and isinstance(ckpt.names, (list, tuple)):
             ckpt.names = dict(enumerate(ckpt.names))  # convert to dict
+        if prune and hasattr(ckpt, 'prune_aux'):
+            ckpt.prune_aux()  # single-head inference graph
 
         model.append(ckpt.fuse().eval() if fuse and hasattr(ckpt, 'fuse') else ckpt.eval())  # model in eval mode
 
@@ -261,6 +307,9 @@ def attempt_load(weights, device=None, inplace=True, fuse=True):
             #    setattr(m, 'anchor_grid', [torch.zeros(1)] * m.nl)
         elif t is nn.Upsample and not hasattr(m, 'recompute_scale_factor'):
             m.recompute_scale_factor = None  # torch 1.11.0 compatibility
+        if isinstance(m, (Detect, DDetect, DualDetect, DualDDetect, TripleDetect, TripleDDetect)) and \
+                not hasattr(m, 'anchor_cache'):
+            m.anchor_cache = AnchorCache()  # Detect heads saved before the anchor cache
 
     # Return model
     if len(model) == 1:
@@ -18,7 +18,7 @@ from utils.general import LOGGER, check_version, check_yaml, make_divisible, pri
 from utils.plots import feature_visualization
 from utils.torch_utils import (fuse_conv_and_bn, initialize_weights, model_info, profile, scale_img, select_device,
                                time_sync)
-from utils.tal.anchor_generator import make_anchors, dist2bbox
+from utils.tal.anchor_generator import AnchorCache, dist2bbox
 
 try:
     import thop  # for FLOPs computation
@@ -42,6 +42,7 @@ class Detect(nn.Module):
         self.no = nc + self.reg_max * 4  # number of outputs per anchor
         self.inplace = inplace  # use inplace ops (e.g. slice assignment)
         self.stride = torch.zeros(self.nl)  # strides computed during build
+        self.anchor_cache = AnchorCache()  # anchors and strides per input shape, shared by all branches
 
         c2, c3 = max((ch[0] // 4, self.reg_max * 4, 16)), max((ch[0], min((self.nc * 2, 128))))  # channels
         self.cv2 = nn.ModuleList(
@@ -56,12 +57,10 @@ class Detect(nn.Module):
             x[i] = torch.cat((self.cv2[i](x[i]), self.cv3[i](x[i])), 1)
         if self.training:
             return x
-        elif self.dynamic or self.shape != shape:
-            self.anchors, self.strides = (x.transpose(0, 1) for x in make_anchors(x, self.stride, 0.5))
-            self.shape = shape
+        anchors, strides = self.anchor_cache(x, self.stride, 0.5, cache=not self.dynamic)
 
         box, cls = torch.cat([xi.view(shape[0], self.no, -1) for xi in x], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox = dist2bbox(self.dfl(box), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox = dist2bbox(self.dfl(box), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         y = torch.cat((dbox, cls.sigmoid()), 1)
         return y if self.export else (y, x)
 
@@ -91,6 +90,7 @@ class DDetect(nn.Module):
         self.no = nc + self.reg_max * 4  # number of outputs per anchor
         self.inplace = inplace  # use inplace ops (e.g. slice assignment)
         self.stride = torch.zeros(self.nl)  # strides computed during build
+        self.anchor_cache = AnchorCache()  # anchors and strides per input shape, shared by all branches
 
         c2, c3 = make_divisible(max((ch[0] // 4, self.reg_max * 4, 16)), 4), max((ch[0], min((self.nc * 2, 128))))  # channels
         self.cv2 = nn.ModuleList(
@@ -105,12 +105,10 @@ class DDetect(nn.Module):
             x[i] = torch.cat((self.cv2[i](x[i]), self.cv3[i](x[i])), 1)
         if self.training:
             return x
-        elif self.dynamic or self.shape != shape:
-            self.anchors, self.strides = (x.transpose(0, 1) for x in make_anchors(x, self.stride, 0.5))
-            self.shape = shape
+        anchors, strides = self.anchor_cache(x, self.stride, 0.5, cache=not self.dynamic)
 
         box, cls = torch.cat([xi.view(shape[0], self.no, -1) for xi in x], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox = dist2bbox(self.dfl(box), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox = dist2bbox(self.dfl(box), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         y = torch.cat((dbox, cls.sigmoid()), 1)
         return y if self.export else (y, x)
 
@@ -128,6 +126,7 @@ class DualDetect(nn.Module):
     # YOLO Detect head for detection models
     dynamic = False  # force grid reconstruction
     export = False  # export mode
+    prune = False  # main branch only, set by BaseModel.prune_aux()
     shape = None
     anchors = torch.empty(0)  # init
     strides = torch.empty(0)  # init
@@ -140,6 +139,7 @@ class DualDetect(nn.Module):
         self.no = nc + self.reg_max * 4  # number of outputs per anchor
         self.inplace = inplace  # use inplace ops (e.g. slice assignment)
         self.stride = torch.zeros(self.nl)  # strides computed during build
+        self.anchor_cache = AnchorCache()  # anchors and strides per input shape, shared by all branches
 
         c2, c3 = max((ch[0] // 4, self.reg_max * 4, 16)), max((ch[0], min((self.nc * 2, 128))))  # channels
         c4, c5 = max((ch[self.nl] // 4, self.reg_max * 4, 16)), max((ch[self.nl], min((self.nc * 2, 128))))  # channels
@@ -155,6 +155,8 @@ class DualDetect(nn.Module):
         self.dfl2 = DFL(self.reg_max)
 
     def forward(self, x):
+        if self.prune:  # auxiliary inputs x[:nl] not computed
+            return self.forward_main(x[self.nl:])
         shape = x[0].shape  # BCHW
         d1 = []
         d2 = []
@@ -163,17 +165,28 @@ class DualDetect(nn.Module):
             d2.append(torch.cat((self.cv4[i](x[self.nl+i]), self.cv5[i](x[self.nl+i])), 1))
         if self.training:
             return [d1, d2]
-        elif self.dynamic or self.shape != shape:
-            self.anchors, self.strides = (d1.transpose(0, 1) for d1 in make_anchors(d1, self.stride, 0.5))
-            self.shape = shape
+        anchors, strides = self.anchor_cache(d1, self.stride, 0.5, cache=not self.dynamic)
 
         box, cls = torch.cat([di.view(shape[0], self.no, -1) for di in d1], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox = dist2bbox(self.dfl(box), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox = dist2bbox(self.dfl(box), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         box2, cls2 = torch.cat([di.view(shape[0], self.no, -1) for di in d2], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox2 = dist2bbox(self.dfl2(box2), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox2 = dist2bbox(self.dfl2(box2), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         y = [torch.cat((dbox, cls.sigmoid()), 1), torch.cat((dbox2, cls2.sigmoid()), 1)]
         return y if self.export else (y, [d1, d2])
 
+    def forward_main(self, x):
+        # Main branch (cv4, cv5) only, returns the same single output as DDetect
+        shape = x[0].shape  # BCHW
+        d2 = [torch.cat((self.cv4[i](x[i]), self.cv5[i](x[i])), 1) for i in range(self.nl)]
+        if self.training:
+            return d2
+        anchors, strides = self.anchor_cache(d2, self.stride, 0.5, cache=not self.dynamic)
+
+        box2, cls2 = torch.cat([di.view(shape[0], self.no, -1) for di in d2], 2).split((self.reg_max * 4, self.nc), 1)
+        dbox2 = dist2bbox(self.dfl2(box2), anchors.unsqueeze(0), xywh=True, dim=1) * strides
+        y = torch.cat((dbox2, cls2.sigmoid()), 1)
+        return y if self.export else (y, d2)
+
     def bias_init(self):
         # Initialize Detect() biases, WARNING: requires stride availability
         m = self  # self.model[-1]  # Detect() module
@@ -191,6 +204,7 @@ class DualDDetect(nn.Module):
     # YOLO Detect head for detection models
     dynamic = False  # force grid reconstruction
     export = False  # export mode
+    prune = False  # main branch only, set by BaseModel.prune_aux()
     shape = None
     anchors = torch.empty(0)  # init
     strides = torch.empty(0)  # init
@@ -203,6 +217,7 @@ class DualDDetect(nn.Module):
         self.no = nc + self.reg_max * 4  # number of outputs per anchor
         self.inplace = inplace  # use inplace ops (e.g. slice assignment)
         self.stride = torch.zeros(self.nl)  # strides computed during build
+        self.anchor_cache = AnchorCache()  # anchors and strides per input shape, shared by all branches
 
         c2, c3 = make_divisible(max((ch[0] // 4, self.reg_max * 4, 16)), 4), max((ch[0], min((self.nc * 2, 128))))  # channels
         c4, c5 = make_divisible(max((ch[self.nl] // 4, self.reg_max * 4, 16)), 4), max((ch[self.nl], min((self.nc * 2, 128))))  # channels
@@ -218,6 +233,8 @@ class DualDDetect(nn.Module):
         self.dfl2 = DFL(self.reg_max)
 
     def forward(self, x):
+        if self.prune:  # auxiliary inputs x[:nl] not computed
+            return self.forward_main(x[self.nl:])
         shape = x[0].shape  # BCHW
         d1 = []
         d2 = []
@@ -226,14 +243,12 @@ class DualDDetect(nn.Module):
             d2.append(torch.cat((self.cv4[i](x[self.nl+i]), self.cv5[i](x[self.nl+i])), 1))
         if self.training:
             return [d1, d2]
-        elif self.dynamic or self.shape != shape:
-            self.anchors, self.strides = (d1.transpose(0, 1) for d1 in make_anchors(d1, self.stride, 0.5))
-            self.shape = shape
+        anchors, strides = self.anchor_cache(d1, self.stride, 0.5, cache=not self.dynamic)
 
         box, cls = torch.cat([di.view(shape[0], self.no, -1) for di in d1], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox = dist2bbox(self.dfl(box), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox = dist2bbox(self.dfl(box), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         box2, cls2 = torch.cat([di.view(shape[0], self.no, -1) for di in d2], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox2 = dist2bbox(self.dfl2(box2), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox2 = dist2bbox(self.dfl2(box2), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         y = [torch.cat((dbox, cls.sigmoid()), 1), torch.cat((dbox2, cls2.sigmoid()), 1)]
         return y if self.export else (y, [d1, d2])
         #y = torch.cat((dbox2, cls2.sigmoid()), 1)
@@ -243,6 +258,19 @@ class DualDDetect(nn.Module):
         #return [y1, y2] if self.export else [(y1, d1), (y2, d2)]
         #return [y1, y2] if self.export else [(y1, y2), (d1, d2)]
 
+    def forward_main(self, x):
+        # Main branch (cv4, cv5) only, returns the same single output as DDetect
+        shape = x[0].shape  # BCHW
+        d2 = [torch.cat((self.cv4[i](x[i]), self.cv5[i](x[i])), 1) for i in range(self.nl)]
+        if self.training:
+            return d2
+        anchors, strides = self.anchor_cache(d2, self.stride, 0.5, cache=not self.dynamic)
+
+        box2, cls2 = torch.cat([di.view(shape[0], self.no, -1) for di in d2], 2).split((self.reg_max * 4, self.nc), 1)
+        dbox2 = dist2bbox(self.dfl2(box2), anchors.unsqueeze(0), xywh=True, dim=1) * strides
+        y = torch.cat((dbox2, cls2.sigmoid()), 1)
+        return y if self.export else (y, d2)
+
     def bias_init(self):
         # Initialize Detect() biases, WARNING: requires stride availability
         m = self  # self.model[-1]  # Detect() module
@@ -272,6 +300,7 @@ class TripleDetect(nn.Module):
         self.no = nc + self.reg_max * 4  # number of outputs per anchor
         self.inplace = inplace  # use inplace ops (e.g. slice assignment)
         self.stride = torch.zeros(self.nl)  # strides computed during build
+        self.anchor_cache = AnchorCache()  # anchors and strides per input shape, shared by all branches
 
         c2, c3 = max((ch[0] // 4, self.reg_max * 4, 16)), max((ch[0], min((self.nc * 2, 128))))  # channels
         c4, c5 = max((ch[self.nl] // 4, self.reg_max * 4, 16)), max((ch[self.nl], min((self.nc * 2, 128))))  # channels
@@ -303,16 +332,14 @@ class TripleDetect(nn.Module):
             d3.append(torch.cat((self.cv6[i](x[self.nl*2+i]), self.cv7[i](x[self.nl*2+i])), 1))
         if self.training:
             return [d1, d2, d3]
-        elif self.dynamic or self.shape != shape:
-            self.anchors, self.strides = (d1.transpose(0, 1) for d1 in make_anchors(d1, self.stride, 0.5))
-            self.shape = shape
+        anchors, strides = self.anchor_cache(d1, self.stride, 0.5, cache=not self.dynamic)
 
         box, cls = torch.cat([di.view(shape[0], self.no, -1) for di in d1], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox = dist2bbox(self.dfl(box), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox = dist2bbox(self.dfl(box), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         box2, cls2 = torch.cat([di.view(shape[0], self.no, -1) for di in d2], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox2 = dist2bbox(self.dfl2(box2), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox2 = dist2bbox(self.dfl2(box2), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         box3, cls3 = torch.cat([di.view(shape[0], self.no, -1) for di in d3], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox3 = dist2bbox(self.dfl3(box3), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox3 = dist2bbox(self.dfl3(box3), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         y = [torch.cat((dbox, cls.sigmoid()), 1), torch.cat((dbox2, cls2.sigmoid()), 1), torch.cat((dbox3, cls3.sigmoid()), 1)]
         return y if self.export else (y, [d1, d2, d3])
 
@@ -348,6 +375,7 @@ class TripleDDetect(nn.Module):
         self.no = nc + self.reg_max * 4  # number of outputs per anchor
         self.inplace = inplace  # use inplace ops (e.g. slice assignment)
         self.stride = torch.zeros(self.nl)  # strides computed during build
+        self.anchor_cache = AnchorCache()  # anchors and strides per input shape, shared by all branches
 
         c2, c3 = make_divisible(max((ch[0] // 4, self.reg_max * 4, 16)), 4), \
                                 max((ch[0], min((self.nc * 2, 128))))  # channels
@@ -385,16 +413,14 @@ class TripleDDetect(nn.Module):
             d3.append(torch.cat((self.cv6[i](x[self.nl*2+i]), self.cv7[i](x[self.nl*2+i])), 1))
         if self.training:
             return [d1, d2, d3]
-        elif self.dynamic or self.shape != shape:
-            self.anchors, self.strides = (d1.transpose(0, 1) for d1 in make_anchors(d1, self.stride, 0.5))
-            self.shape = shape
+        anchors, strides = self.anchor_cache(d1, self.stride, 0.5, cache=not self.dynamic)
 
         box, cls = torch.cat([di.view(shape[0], self.no, -1) for di in d1], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox = dist2bbox(self.dfl(box), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox = dist2bbox(self.dfl(box), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         box2, cls2 = torch.cat([di.view(shape[0], self.no, -1) for di in d2], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox2 = dist2bbox(self.dfl2(box2), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox2 = dist2bbox(self.dfl2(box2), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         box3, cls3 = torch.cat([di.view(shape[0], self.no, -1) for di in d3], 2).split((self.reg_max * 4, self.nc), 1)
-        dbox3 = dist2bbox(self.dfl3(box3), self.anchors.unsqueeze(0), xywh=True, dim=1) * self.strides
+        dbox3 = dist2bbox(self.dfl3(box3), anchors.unsqueeze(0), xywh=True, dim=1) * strides
         #y = [torch.cat((dbox, cls.sigmoid()), 1), torch.cat((dbox2, cls2.sigmoid()), 1), torch.cat((dbox3, cls3.sigmoid()), 1)]
         #return y if self.export else (y, [d1, d2, d3])
         y = torch.cat((dbox3, cls3.sigmoid()), 1)
@@ -518,6 +544,16 @@ class Panoptic(Detect):
         return (torch.cat([x, mc], 1), p, s) if self.export else (torch.cat([x[0], mc], 1), (x[1], mc, p, s))
     
 
+class Pruned(nn.Module):
+    # Placeholder for a layer removed by BaseModel.prune_aux(), keeps the layer indices of the model
+    def __init__(self, m):
+        super().__init__()
+        self.f, self.i, self.type, self.np = m.f, m.i, m.type, 0
+
+    def forward(self, x):
+        return None
+
+
 class BaseModel(nn.Module):
     # YOLO base model
     def forward(self, x, profile=False, visualize=False):
@@ -562,6 +598,33 @@ class BaseModel(nn.Module):
         self.info()
         return self
 
+    def prune_aux(self):
+        # Drop the auxiliary branch of a DualDetect/DualDDetect model for inference, i.e. yolov9-c to gelan-c: the
+        # layers feeding only the auxiliary head inputs and the head's cv2, cv3, dfl. The head then returns the main
+        # branch output like DDetect. Training a pruned model is not supported
+        m = self.model[-1]  # Detect()
+        if type(m) not in (DualDetect, DualDDetect) or m.prune:
+            return self
+        keep, todo = set(), list(m.f[m.nl:])  # layers needed by the main branch
+        while todo:
+            i = todo.pop()
+            if i in keep:
+                continue
+            keep.add(i)
+            f = self.model[i].f
+            todo += [i - 1 if j == -1 else j for j in ([f] if isinstance(f, int) else f) if j != -1 or i > 0]
+        n = sum(x.numel() for x in [*m.cv2.parameters(), *m.cv3.parameters(), *m.dfl.parameters()])
+        k = 0
+        for i, x in enumerate(self.model[:-1]):
+            if i not in keep and not isinstance(x, Pruned):
+                n += sum(p.numel() for p in x.parameters())
+                self.model[i] = Pruned(x)
+                k += 1
+        m.cv2, m.cv3, m.dfl = None, None, None
+        m.prune = True
+        LOGGER.info(f'Pruned auxiliary branch: {k} layers, {n} parameters')
+        return self
+
     def info(self, verbose=False, img_size=640):  # print model information
         model_info(self, verbose, img_size)
 
@@ -0,0 +1,302 @@
+"""
+Local batched inference server for many camera clients
+
+Usage:
+    $ python serve.py --weights best.pt --port 8000 --max-batch 8 --max-wait 5
+    $ python serve.py --weights best.pt --unix /tmp/yolo.sock
+
+    $ curl --data-binary @frame.jpg 'http://127.0.0.1:8000/detect?stream=cam1'
+    {"stream": "cam1", "shape": [720, 1280], "detections": [[x1, y1, x2, y2, conf, cls], ...]}
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]  # YOLO root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
+
+from models.common import DetectMultiBackend
+from utils.augmentations import letterbox
+from utils.general import LOGGER, check_img_size, colorstr, non_max_suppression, print_args, scale_boxes
+from utils.torch_utils import select_device, smart_inference_mode
+
+
+class Busy(Exception):
+    # Raised when a stream has too many pending requests (backpressure)
+    pass
+
+
+class Closed(Exception):
+    # Raised for requests submitted to, or still pending in, a closed MicroBatcher
+    pass
+
+
+class MicroBatcher:
+    # Dynamic micro-batching over DetectMultiBackend with per-stream round-robin fairness and bounded queues
+    def __init__(self,
+                 model,
+                 imgsz=640,
+                 max_batch=8,
+                 max_wait=5.0,
+                 max_pending=4,
+                 conf_thres=0.25,
+                 iou_thres=0.45,
+                 classes=None,
+                 agnostic=False,
+                 max_det=300):
+        self.model = model
+        self.imgsz = (imgsz, imgsz) if isinstance(imgsz, int) else tuple(imgsz)
+        self.static_batch = self._static_batch(model)  # fixed backend batch size, None if dynamic
+        self.max_batch = max_batch if self.static_batch is None else min(max_batch, self.static_batch)
+        self.max_wait = max_wait / 1E3  # ms to seconds
+        self.max_pending = max_pending  # per-stream queue limit
+        self.nms = dict(conf_thres=conf_thres, iou_thres=iou_thres, classes=classes, agnostic=agnostic, max_det=max_det)
+        self.queues = collections.OrderedDict()  # stream -> deque of pending requests
+        self.cond = threading.Condition()
+        self.stats = collections.Counter()  # requests, batches, images, rejected
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, name='batcher', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _static_batch(model):
+        # Batch size a backend was exported with, None if any batch size is accepted
+        if model.pt or model.jit:
+            return None
+        if model.engine:
+            return None if model.dynamic else model.batch_size
+        if model.onnx and not model.dnn:
+            b = model.session.get_inputs()[0].shape[0]
+            return b if isinstance(b, int) else None
+        return getattr(model, 'batch_size', 1) or 1
+
+    def submit(self, im0, stream='default'):
+        # Queue a BGR HWC image, returns Future -> (n,6) numpy array [xyxy, conf, cls] in im0 pixels
+        im = letterbox(im0, self.imgsz, stride=self.model.stride, auto=False)[0]
+        im = np.ascontiguousarray(im.transpose((2, 0, 1))[::-1])  # HWC to CHW, BGR to RGB
+        future = Future()
+        with self.cond:
+            if not self.running:
+                raise Closed('batcher is closed')
+            q = self.queues.setdefault(stream, collections.deque())
+            if len(q) >= self.max_pending:
+                self.stats['rejected'] += 1
+                raise Busy(f'stream {stream} has {len(q)} pending requests')
+            q.append((im, im0.shape[:2], future, time.monotonic()))
+            self.stats['requests'] += 1
+            self.cond.notify()
+        return future
+
+    def _collect(self):
+        # Wait for the first request, then gather round-robin across streams until max_batch or max_wait
+        with self.cond:
+            while self.running and not any(self.queues.values()):
+                self.cond.wait(0.5)
+            if not self.running:
+                return []
+            oldest = min(q[0][3] for q in self.queues.values() if q)
+            while self.running and sum(map(len, self.queues.values())) < self.max_batch:
+                remaining = oldest + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch = []
+            while len(batch) < self.max_batch and any(self.queues.values()):
+                for stream in list(self.queues):  # one request per stream per round
+                    q = self.queues[stream]
+                    if q and len(batch) < self.max_batch:
+                        batch.append(q.popleft())
+                    if not q:
+                        del self.queues[stream]
+                    else:
+                        self.queues.move_to_end(stream)  # stream served, goes to the back of the line
+            return batch
+
+    @smart_inference_mode()
+    def _infer(self, batch):
+        im = torch.from_numpy(np.stack([b[0] for b in batch])).to(self.model.device)
+        if self.static_batch and len(batch) < self.static_batch:  # pad to the exported batch size
+            im = torch.cat((im, im.new_zeros((self.static_batch - len(batch), *im.shape[1:]))))
+        im = im.half() if self.model.fp16 else im.float()  # uint8 to fp16/32
+        im /= 255  # 0 - 255 to 0.0 - 1.0
+        pred = non_max_suppression(self.model(im), **self.nms)
+        out = []
+        for det, (_, shape0, _, _) in zip(pred, batch):
+            scale_boxes(im.shape[2:], det[:, :4], shape0)
+            out.append(det.cpu().numpy())
+        return out
+
+    def _loop(self):
+        while self.running:
+            batch = self._collect()
+            if not batch:
+                continue
+            try:
+                results = self._infer(batch)
+            except Exception as e:
+                for b in batch:
+                    b[2].set_exception(e)
+                continue
+            self.stats['batches'] += 1
+            self.stats['images'] += len(batch)
+            for b, r in zip(batch, results):
+                b[2].set_result(r)
+
+    def close(self):
+        # Stop the batching thread, requests not yet batched fail with Closed instead of waiting for their timeout
+        with self.cond:
+            self.running = False
+            pending = [b for q in self.queues.values() for b in q]
+            self.queues.clear()
+            self.cond.notify_all()
+        for b in pending:
+            b[2].set_exception(Closed('batcher closed before the request was run'))
+        self.thread.join(1.0)
+
+
+class DetectHandler(BaseHTTPRequestHandler):
+    # POST /detect?stream=<id> with an encoded image body, GET /stats
+    batcher = None  # MicroBatcher, set by run()
+    timeout = 30
+
+    def log_message(self, format, *args):
+        pass  # silence per-request logging
+
+    def _reply(self, code, d):
+        body = json.dumps(d).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path == '/stats':
+            self._reply(200, dict(self.batcher.stats))
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/detect':
+            return self._reply(404, {'error': 'not found'})
+        stream = parse_qs(url.query).get('stream', ['default'])[0]
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        im0 = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if im0 is None:
+            return self._reply(400, {'error': 'could not decode image'})
+        try:
+            det = self.batcher.submit(im0, stream).result(self.timeout)
+        except Busy as e:
+            return self._reply(429, {'error': str(e)})
+        except Closed as e:
+            return self._reply(503, {'error': str(e)})
+        except Exception as e:
+            return self._reply(500, {'error': str(e)})
+        self._reply(200, {'stream': stream, 'shape': im0.shape[:2], 'detections': det.round(3).tolist()})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # HTTP over a Unix domain socket
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)  # BaseHTTPRequestHandler expects a (host, port) client address
+
+
+def run(
+        weights=ROOT / 'yolo.pt',  # model path
+        data=None,  # dataset.yaml path (class names)
+        imgsz=640,  # inference size (pixels)
+        device='',  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+        half=False,  # use FP16 half-precision inference
+        dnn=False,  # use OpenCV DNN for ONNX inference
+        host='127.0.0.1',  # HTTP host
+        port=8000,  # HTTP port
+        unix='',  # Unix socket path, overrides host/port
+        max_batch=8,  # maximum micro-batch size
+        max_wait=5.0,  # maximum wait (ms) for a micro-batch to fill
+        max_pending=4,  # maximum pending requests per stream before HTTP 429
+        conf_thres=0.25,  # confidence threshold
+        iou_thres=0.45,  # NMS IoU threshold
+        classes=None,  # filter by class: --classes 0, or --classes 0 2 3
+        agnostic_nms=False,  # class-agnostic NMS
+        max_det=300,  # maximum detections per image
+):
+    device = select_device(device)
+    model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half)
+    imgsz = check_img_size(imgsz, s=model.stride)  # check image size
+    batcher = MicroBatcher(model, imgsz, max_batch, max_wait, max_pending, conf_thres, iou_thres, classes,
+                           agnostic_nms, max_det)
+    model.warmup(imgsz=(1 if model.pt else batcher.static_batch or 1, 3, imgsz, imgsz))  # warmup
+    DetectHandler.batcher = batcher
+
+    if unix:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(unix)
+        server = UnixHTTPServer(unix, DetectHandler)
+        where = unix
+    else:
+        server = ThreadingHTTPServer((host, port), DetectHandler)
+        where = f'http://{host}:{port}'
+    LOGGER.info(f"{colorstr('serve:')} listening on {where} (max batch {batcher.max_batch}, max wait {max_wait}ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        LOGGER.info(f"{colorstr('serve:')} {dict(batcher.stats)}")
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', type=str, default=ROOT / 'yolo.pt', help='model path')
+    parser.add_argument('--data', type=str, default=None, help='(optional) dataset.yaml path')
+    parser.add_argument('--imgsz', '--img', '--img-size', type=int, default=640, help='inference size (pixels)')
+    parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
+    parser.add_argument('--half', action='store_true', help='use FP16 half-precision inference')
+    parser.add_argument('--dnn', action='store_true', help='use OpenCV DNN for ONNX inference')
+    parser.add_argument('--host', default='127.0.0.1', help='HTTP host')
+    parser.add_argument('--port', type=int, default=8000, help='HTTP port')
+    parser.add_argument('--unix', default='', help='serve on a Unix socket path instead of host:port')
+    parser.add_argument('--max-batch', type=int, default=8, help='maximum micro-batch size')
+    parser.add_argument('--max-wait', type=float, default=5.0, help='maximum micro-batch wait (ms)')
+    parser.add_argument('--max-pending', type=int, default=4, help='maximum pending requests per stream')
+    parser.add_argument('--conf-thres', type=float, default=0.25, help='confidence threshold')
+    parser.add_argument('--iou-thres', type=float, default=0.45, help='NMS IoU threshold')
+    parser.add_argument('--classes', nargs='+', type=int, help='filter by class: --classes 0, or --classes 0 2 3')
+    parser.add_argument('--agnostic-nms', action='store_true', help='class-agnostic NMS')
+    parser.add_argument('--max-det', type=int, default=300, help='maximum detections per image')
+    opt = parser.parse_args()
+    print_args(vars(opt))
+    return opt
+
+
+def main(opt):
+    run(**vars(opt))
+
+
+if __name__ == "__main__":
+    opt = parse_opt()
+    main(opt)
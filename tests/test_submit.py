@@ -0,0 +1,61 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLO root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('cv2')
+from models.common import DetectMultiBackend  # noqa: E402
+
+
+class FakeNet:
+    # cv2.dnn.Net stand-in, counts calls that overlap between setInput() and forward() of another thread
+    def __init__(self):
+        self.busy = threading.Lock()
+        self.overlaps = 0
+        self.im = None
+
+    def setInput(self, im):
+        if not self.busy.acquire(blocking=False):
+            self.overlaps += 1
+            self.busy.acquire()
+        self.im = im
+        time.sleep(0.01)  # widen the race window
+
+    def forward(self):
+        y = self.im.sum((1, 2, 3)).reshape(-1, 1)
+        self.busy.release()
+        return y
+
+
+def dnn_backend(slots=2):
+    # DetectMultiBackend as built for an ONNX model with dnn=True, without reading a model file
+    m = DetectMultiBackend.__new__(DetectMultiBackend)
+    torch.nn.Module.__init__(m)
+    types = ('pt', 'jit', 'onnx', 'onnx_end2end', 'xml', 'engine', 'coreml', 'saved_model', 'pb', 'tflite', 'edgetpu',
+             'tfjs', 'paddle', 'triton', 'fp16', 'nhwc')
+    m.__dict__.update(dict.fromkeys(types, False))
+    m.__dict__.update(onnx=True,
+                      dnn=True,
+                      net=FakeNet(),
+                      device=torch.device('cpu'),
+                      slots=slots,
+                      executor=None,
+                      executor_lock=threading.Lock())
+    return m
+
+
+def test_submit_dnn():
+    m = dnn_backend()
+    futures = [m.submit(torch.full((1, 3, 8, 8), float(i))) for i in range(6)]
+    y = [f.result(timeout=10) for f in futures]
+    assert m.net.overlaps == 0, 'cv2.dnn.Net called from several threads at once'
+    for i, x in enumerate(y):
+        assert float(x.sum()) == i * 3 * 8 * 8
@@ -4,6 +4,7 @@ import random
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 import torchvision.transforms as T
 import torchvision.transforms.functional as TF
 
@@ -103,9 +104,9 @@ def replicate(im, labels):
     return im, labels
 
 
-def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32):
-    # Resize and pad image while meeting stride-multiple constraints
-    shape = im.shape[:2]  # current shape [height, width]
+def letterbox_params(shape, new_shape=(640, 640), auto=True, scaleFill=False, scaleup=True, stride=32):
+    # letterbox() geometry for image shape [height, width], returns resized (w, h), ratio, (dw, dh) and
+    # (top, bottom, left, right) borders. Shared by all letterbox implementations so scale_boxes() metadata matches
     if isinstance(new_shape, int):
         new_shape = (new_shape, new_shape)
 
@@ -127,15 +128,68 @@ def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleF
 
     dw /= 2  # divide padding into 2 sides
     dh /= 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    return new_unpad, ratio, (dw, dh), (top, bottom, left, right)
+
 
+def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32):
+    # Resize and pad image while meeting stride-multiple constraints
+    shape = im.shape[:2]  # current shape [height, width]
+    new_unpad, ratio, (dw, dh), (top, bottom, left, right) = letterbox_params(shape, new_shape, auto, scaleFill,
+                                                                              scaleup, stride)
     if shape[::-1] != new_unpad:  # resize
         im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
-    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
-    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
     im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
     return im, ratio, (dw, dh)
 
 
+def letterbox_into(im, dst, color=(114, 114, 114)):
+    # letterbox(im, dst.shape[:2], auto=False) written in place into a preallocated HWC uint8 array dst, no copies
+    shape = im.shape[:2]
+    (w, h), ratio, (dw, dh), (top, _, left, _) = letterbox_params(shape, dst.shape[:2], auto=False)
+    roi = dst[top:top + h, left:left + w]
+    if shape[::-1] != (w, h):
+        cv2.resize(im, (w, h), dst=roi, interpolation=cv2.INTER_LINEAR)
+    else:
+        np.copyto(roi, im)
+    dst[:top], dst[top + h:] = color, color  # borders
+    dst[top:top + h, :left], dst[top:top + h, left + w:] = color, color
+    return dst, ratio, (dw, dh)
+
+
+def letterbox_torch(ims,
+                    new_shape=(640, 640),
+                    color=(114, 114, 114),
+                    auto=True,
+                    scaleFill=False,
+                    scaleup=True,
+                    stride=32,
+                    device='cpu',
+                    dtype=torch.float32):
+    # Batched letterbox() on device: list of HWC uint8 BGR images (numpy or tensors) -> RGB BCHW 0-1 tensor, ratios
+    # and pads. Same-shaped images are resized in one interpolate call, geometry matches letterbox() for scale_boxes()
+    groups = {}  # image indices by shape
+    for i, im in enumerate(ims):
+        groups.setdefault(tuple(im.shape[:2]), []).append(i)
+    out, ratios, pads = [None] * len(ims), [None] * len(ims), [None] * len(ims)
+    fill = torch.tensor(color[::-1], device=device, dtype=dtype).view(1, 3, 1, 1) / 255  # BGR to RGB
+    for shape, idx in groups.items():
+        x = [ims[i] for i in idx]
+        x = torch.from_numpy(np.stack(x)) if isinstance(x[0], np.ndarray) else torch.stack(x)
+        x = x.to(device, non_blocking=True).permute(0, 3, 1, 2).flip(1).to(dtype) / 255  # BHWC BGR to BCHW RGB, 0-1
+        (w, h), ratio, dwdh, (top, bottom, left, right) = letterbox_params(shape, new_shape, auto, scaleFill, scaleup,
+                                                                           stride)
+        if shape[::-1] != (w, h):  # resize
+            x = F.interpolate(x, size=(h, w), mode='bilinear', align_corners=False)
+        y = fill.repeat(len(idx), 1, top + h + bottom, left + w + right)  # border
+        y[..., top:top + h, left:left + w] = x
+        for j, i in enumerate(idx):
+            out[i], ratios[i], pads[i] = y[j], ratio, dwdh
+    assert len({x.shape for x in out}) == 1, 'letterbox_torch() images letterbox to different shapes, use auto=False'
+    return torch.stack(out), ratios, pads
+
+
 def random_perspective(im,
                        targets=(),
                        segments=(),
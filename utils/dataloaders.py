@@ -10,7 +10,7 @@ import time
 from itertools import repeat
 from multiprocessing.pool import Pool, ThreadPool
 from pathlib import Path
-from threading import Thread
+from threading import Condition, Thread
 from urllib.parse import urlparse
 
 import numpy as np
@@ -24,7 +24,8 @@ from torch.utils.data import DataLoader, Dataset, dataloader, distributed
 from tqdm import tqdm
 
 from utils.augmentations import (Albumentations, augment_hsv, classify_albumentations, classify_transforms, copy_paste,
-                                 letterbox, mixup, random_perspective)
+                                 letterbox, letterbox_params, letterbox_torch, mixup, random_perspective)
+from utils.gating import MotionGate
 from utils.general import (DATASETS_DIR, LOGGER, NUM_THREADS, TQDM_BAR_FORMAT, check_dataset, check_requirements,
                            check_yaml, clean_str, cv2, is_colab, is_kaggle, segments2boxes, unzip_file, xyn2xy,
                            xywh2xyxy, xywhn2xyxy, xyxy2xywhn)
@@ -234,9 +235,99 @@ class LoadScreenshots:
         return str(self.screen), im, im0, None, s  # screen, img, original img, im0s, s
 
 
+class VideoSource:
+    # Threaded video decoder. A background thread decodes ahead into a ring of preallocated BGR frames, optionally
+    # resized at decode time so full-size frames never leave the thread. Like cv2.VideoCapture: read(), get(), release()
+    # Returned frames are ring slots: the last `hold` frames read stay valid, copy them to keep them longer
+    def __init__(self, path, buffer=4, hold=2, size=None, vid_stride=1, hw_accel=False):
+        params = []
+        if hw_accel and hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):  # OpenCV>=4.5.2, FFmpeg/GStreamer/MSMF backends
+            params = [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+        self.cap = cv2.VideoCapture(str(path), cv2.CAP_ANY, params) if params else cv2.VideoCapture(str(path))
+        assert self.cap.isOpened(), f'Failed to open {path}'
+        w, h = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.size = tuple(size) if size else (w, h)  # output frame (width, height)
+        self.raw = np.empty((h, w, 3), dtype=np.uint8) if self.size != (w, h) else None  # full-size decode buffer
+        self.buffer = max(int(buffer), 1)  # frames decoded ahead
+        self.ring = np.empty((self.buffer + hold, self.size[1], self.size[0], 3), dtype=np.uint8)  # preallocated
+        self.vid_stride = vid_stride  # video frame-rate stride
+        self.cond = Condition()
+        self._start()
+
+    def _start(self):
+        self.head = self.tail = 0  # frames decoded, frames read
+        self.ended, self.running = False, True
+        self.thread = Thread(target=self._decode, daemon=True)
+        self.thread.start()
+
+    def _stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.thread.join()
+
+    def _decode(self):
+        n = len(self.ring)
+        while True:
+            with self.cond:
+                while self.running and self.head - self.tail >= self.buffer:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                slot = self.ring[self.head % n]
+            ok = all(self.cap.grab() for _ in range(self.vid_stride))  # skip frames without retrieving them
+            if ok:
+                ok, im = self.cap.retrieve(slot if self.raw is None else self.raw)  # decode into the buffer
+                if ok and im is not slot:  # resize at decode (or the backend allocated its own frame)
+                    cv2.resize(im, self.size, dst=slot, interpolation=cv2.INTER_AREA)
+            with self.cond:
+                if ok:
+                    self.head += 1
+                else:
+                    self.ended = True
+                self.cond.notify_all()
+                if self.ended:
+                    return
+
+    def read(self):
+        # Next frame as (True, im), (False, None) at the end of the video
+        with self.cond:
+            while self.head == self.tail and not self.ended and self.running:
+                self.cond.wait()
+            if self.head == self.tail:
+                return False, None
+            im = self.ring[self.tail % len(self.ring)]
+            self.tail += 1
+            self.cond.notify_all()
+            return True, im
+
+    def seek(self, frame):
+        # Jump to frame index (the backend seeks to the previous keyframe and decodes forward), drops buffered frames
+        self._stop()
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+        self._start()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        self._stop()
+        self.cap.release()
+
+    def __iter__(self):
+        while True:
+            ok, im = self.read()
+            if not ok:
+                break
+            yield im
+
+
 class LoadImages:
     # YOLOv5 image/video dataloader, i.e. `python detect.py --source image.jpg/vid.mp4`
-    def __init__(self, path, img_size=640, stride=32, auto=True, transforms=None, vid_stride=1):
+    def __init__(self, path, img_size=640, stride=32, auto=True, transforms=None, vid_stride=1, decode_buffer=0):
         files = []
         for p in sorted(path) if isinstance(path, (list, tuple)) else [path]:
             p = str(Path(p).resolve())
@@ -262,6 +353,7 @@ class LoadImages:
         self.auto = auto
         self.transforms = transforms  # optional
         self.vid_stride = vid_stride  # video frame-rate stride
+        self.decode_buffer = decode_buffer  # >0 decodes videos ahead in a thread, see VideoSource
         if any(videos):
             self._new_video(videos[0])  # new video
         else:
@@ -281,9 +373,12 @@ class LoadImages:
         if self.video_flag[self.count]:
             # Read video
             self.mode = 'video'
-            for _ in range(self.vid_stride):
-                self.cap.grab()
-            ret_val, im0 = self.cap.retrieve()
+            if self.decode_buffer:
+                ret_val, im0 = self.cap.read()  # VideoSource applies vid_stride
+            else:
+                for _ in range(self.vid_stride):
+                    self.cap.grab()
+                ret_val, im0 = self.cap.retrieve()
             while not ret_val:
                 self.count += 1
                 self.cap.release()
@@ -316,7 +411,10 @@ class LoadImages:
     def _new_video(self, path):
         # Create a new video capture object
         self.frame = 0
-        self.cap = cv2.VideoCapture(path)
+        if self.decode_buffer:
+            self.cap = VideoSource(path, buffer=self.decode_buffer, vid_stride=self.vid_stride)
+        else:
+            self.cap = cv2.VideoCapture(path)
         self.frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) / self.vid_stride)
         self.orientation = int(self.cap.get(cv2.CAP_PROP_ORIENTATION_META))  # rotation degrees
         # self.cap.set(cv2.CAP_PROP_ORIENTATION_AUTO, 0)  # disable https://github.com/ultralytics/yolov5/issues/8493
@@ -337,7 +435,15 @@ class LoadImages:
 
 class LoadStreams:
     # YOLOv5 streamloader, i.e. `python detect.py --source 'rtsp://example.com/media.mp4'  # RTSP, RTMP, HTTP streams`
-    def __init__(self, sources='streams.txt', img_size=640, stride=32, auto=True, transforms=None, vid_stride=1):
+    def __init__(self,
+                 sources='streams.txt',
+                 img_size=640,
+                 stride=32,
+                 auto=True,
+                 transforms=None,
+                 vid_stride=1,
+                 motion_gate=None,
+                 device=None):
         torch.backends.cudnn.benchmark = True  # faster for fixed-size inference
         self.mode = 'stream'
         self.img_size = img_size
@@ -347,6 +453,10 @@ class LoadStreams:
         n = len(sources)
         self.sources = [clean_str(x) for x in sources]  # clean source names for later
         self.imgs, self.fps, self.frames, self.threads = [None] * n, [0] * n, [0] * n, [None] * n
+        self.gates = [MotionGate(motion_gate) for _ in range(n)] if motion_gate else None  # 'mog2' or 'diff'
+        self.rois = self.moved = None  # per-stream motion regions and flags, updated by __next__ if motion_gate
+        self.decoded, self.seen, self.dropped = [0] * n, [0] * n, [0] * n  # frames decoded, consumed, never consumed
+        self.telemetry = None  # optional utils.telemetry.Telemetry, see Telemetry.watch_streams()
         for i, s in enumerate(sources):  # index, source
             # Start thread to read frames from video stream
             st = f'{i + 1}/{n}: {s}... '
@@ -374,10 +484,15 @@ class LoadStreams:
         LOGGER.info('')  # newline
 
         # check for common shapes
-        s = np.stack([letterbox(x, img_size, stride=stride, auto=auto)[0].shape for x in self.imgs])
+        s = []
+        for x in self.imgs:  # letterboxed shapes, geometry only
+            (w, h), _, _, (top, bottom, left, right) = letterbox_params(x.shape[:2], img_size, auto=auto, stride=stride)
+            s.append((top + h + bottom, left + w + right))
+        s = np.array(s)
         self.rect = np.unique(s, axis=0).shape[0] == 1  # rect inference if all shapes equal
         self.auto = auto and self.rect
         self.transforms = transforms  # optional
+        self.device = torch.device(device) if device is not None else None  # letterbox batches on device if set
         if not self.rect:
             LOGGER.warning('WARNING ⚠️ Stream shapes differ. For optimal performance supply similarly-shaped streams.')
 
@@ -386,11 +501,15 @@ class LoadStreams:
         n, f = 0, self.frames[i]  # frame number, frame array
         while cap.isOpened() and n < f:
             n += 1
+            t = time.perf_counter()
             cap.grab()  # .read() = .grab() followed by .retrieve()
             if n % self.vid_stride == 0:
                 success, im = cap.retrieve()
                 if success:
                     self.imgs[i] = im
+                    self.decoded[i] += 1
+                    if self.telemetry:
+                        self.telemetry.observe('decode', time.perf_counter() - t, self.sources[i])
                 else:
                     LOGGER.warning('WARNING ⚠️ Video stream unresponsive, please check your IP camera connection.')
                     self.imgs[i] = np.zeros_like(self.imgs[i])
@@ -408,8 +527,16 @@ class LoadStreams:
             raise StopIteration
 
         im0 = self.imgs.copy()
+        for i, d in enumerate(self.decoded):  # frames overwritten before they were read
+            self.dropped[i] += max(d - self.seen[i] - 1, 0)
+            self.seen[i] = d
+        if self.gates:  # motion regions per stream, streams with moved=False can skip inference
+            self.rois = [g(x) for g, x in zip(self.gates, im0)]
+            self.moved = [bool(r) for r in self.rois]
         if self.transforms:
             im = np.stack([self.transforms(x) for x in im0])  # transforms
+        elif self.device is not None:  # resize, BGR to RGB, BCHW and 0-1 in one batch on device, returns a tensor
+            im = letterbox_torch(im0, self.img_size, stride=self.stride, auto=self.auto, device=self.device)[0]
         else:
             im = np.stack([letterbox(x, self.img_size, stride=self.stride, auto=self.auto)[0] for x in im0])  # resize
             im = im[..., ::-1].transpose((0, 3, 1, 2))  # BGR to RGB, BHWC to BCHW
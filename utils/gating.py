@@ -0,0 +1,92 @@
+import cv2
+import numpy as np
+
+
+class KeyframeScheduler:
+    # Decide which frames run the detector: every `interval` frames, earlier if the scene moved more than
+    # `motion_thres` (mean abs difference of a small grayscale thumbnail, 0-255) or if force() was called.
+    # Frames in between are handled by the tracker's motion model alone.
+    def __init__(self, interval=1, motion_thres=0.0, size=64):
+        self.interval = max(int(interval), 1)
+        self.motion_thres = motion_thres  # 0 disables the motion trigger
+        self.size = size  # thumbnail size (pixels)
+        self.count = 0  # frames since last keyframe
+        self.ref = None  # thumbnail of the last keyframe
+        self.forced = True  # first frame is always a keyframe
+
+    def thumbnail(self, frame):
+        im = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(im, (self.size, self.size), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def motion(self, frame):
+        # Mean absolute difference (0-255) between frame and the last keyframe
+        if self.ref is None:
+            return float('inf')
+        return float(np.abs(self.thumbnail(frame) - self.ref).mean())
+
+    def force(self):
+        # Run the detector on the next frame, i.e. when the tracker holds unconfirmed tracks
+        self.forced = True
+
+    def __call__(self, frame):
+        # Returns True if the detector should run on this frame
+        self.count += 1
+        key = self.forced or self.interval == 1 or self.count >= self.interval
+        if not key and self.motion_thres:
+            key = self.motion(frame) > self.motion_thres
+        if key:
+            self.count, self.forced = 0, False
+            if self.interval > 1:
+                self.ref = self.thumbnail(frame)
+        return key
+
+
+class MotionGate:
+    # Motion regions of a frame from a cheap motion mask on a downscaled grayscale copy: MOG2 background subtraction
+    # (method='mog2') or difference with the previous frame (method='diff'). Returns [] when nothing moved.
+    def __init__(self, method='mog2', scale=0.25, thres=25, min_area=5e-4, pad=0.1, max_regions=4, history=500):
+        assert method in ('mog2', 'diff'), f'Invalid motion gate method {method}, valid values are mog2, diff'
+        self.method = method
+        self.scale = scale  # mask resolution relative to the frame
+        self.thres = thres  # pixel difference threshold (diff) or MOG2 variance threshold
+        self.min_area = min_area  # minimum region area as a fraction of the frame
+        self.pad = pad  # region padding as a fraction of its size
+        self.max_regions = max_regions  # more regions are merged into their union box
+        self.prev = None  # previous small grayscale frame (diff)
+        self.mog = cv2.createBackgroundSubtractorMOG2(history, thres, detectShadows=True) if method == 'mog2' else None
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+
+    def mask(self, frame):
+        # Binary uint8 motion mask at self.scale
+        im = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        im = cv2.resize(im, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if self.mog is not None:
+            m = (self.mog.apply(im) == 255).astype(np.uint8)  # 127 = shadow
+        else:
+            im = cv2.GaussianBlur(im, (5, 5), 0)
+            m = np.zeros_like(im) if self.prev is None else (cv2.absdiff(im, self.prev) > self.thres).astype(np.uint8)
+            self.prev = im
+        return cv2.dilate(cv2.morphologyEx(m, cv2.MORPH_OPEN, self.kernel), self.kernel, iterations=2)
+
+    def __call__(self, frame):
+        # Motion regions [[x1, y1, x2, y2], ...] in frame pixels, call on every frame to keep the background model
+        m = self.mask(frame)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(m, connectivity=8)
+        stats = stats[1:]  # drop background
+        stats = stats[stats[:, cv2.CC_STAT_AREA] >= self.min_area * m.size]
+        if not len(stats):
+            return []
+        h, w = frame.shape[:2]
+        xy, wh = stats[:, :2] / self.scale, stats[:, 2:4] / self.scale
+        pad = wh * self.pad
+        boxes = np.concatenate((xy - pad, xy + wh + pad), 1)
+        boxes = np.clip(boxes, 0, [w, h, w, h]).round().astype(int)
+        return merge_regions(boxes.tolist(), self.max_regions)
+
+
+def merge_regions(boxes, max_regions=4):
+    # Replace boxes [[x1, y1, x2, y2], ...] by their union box if there are more than max_regions of them
+    if len(boxes) <= max_regions:
+        return boxes
+    b = np.array(boxes)
+    return [[*b[:, :2].min(0).tolist(), *b[:, 2:].max(0).tolist()]]
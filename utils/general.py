@@ -34,6 +34,7 @@ import yaml
 from utils import TryExcept, emojis
 from utils.downloads import gsutil_getsize
 from utils.metrics import box_iou, fitness
+from utils.nms import NMS_ENGINES, dense_nms, rank_per_image
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[1]  # YOLO root directory
@@ -892,9 +893,18 @@ def non_max_suppression(
         labels=(),
         max_det=300,
         nm=0,  # number of masks
+        topk=None,  # maximum candidate anchors per image, selected on class scores before boxes are gathered
+        topk_per_class=None,  # maximum candidate anchors per class and image
+        engine='greedy',  # NMS algorithm, see utils/nms.py
 ):
     """Non-Maximum Suppression (NMS) on inference results to reject overlapping detections
 
+    All images are processed together: candidates of the whole batch are gathered into one matrix with image indices
+    and suppressed in a single NMS call, boxes offset by image and class so that they never overlap across groups.
+    At low conf_thres, topk and topk_per_class bound the number of candidates (and memory) with torch.topk on the
+    class scores, before any box is gathered. engine='matrix', 'cluster' or 'soft' replaces greedy NMS with a dense
+    engine from utils/nms.py on the top 1000 candidates of each image.
+
     Returns:
          list of detections, on (n,6) tensor per image [xyxy, conf, cls]
     """
@@ -909,88 +919,109 @@ def non_max_suppression(
     bs = prediction.shape[0]  # batch size
     nc = prediction.shape[1] - nm - 4  # number of classes
     mi = 4 + nc  # mask start index
-    xc = prediction[:, 4:mi].amax(1) > conf_thres  # candidates
 
     # Checks
     assert 0 <= conf_thres <= 1, f'Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0'
     assert 0 <= iou_thres <= 1, f'Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0'
+    assert engine in NMS_ENGINES, f'Invalid NMS engine {engine}, valid values are {NMS_ENGINES}'
 
     # Settings
     # min_wh = 2  # (pixels) minimum box width and height
     max_wh = 7680  # (pixels) maximum box width and height
-    max_nms = 30000  # maximum number of boxes into torchvision.ops.nms()
-    time_limit = 2.5 + 0.05 * bs  # seconds to quit after
+    max_nms = 30000  # maximum number of boxes per image into torchvision.ops.nms()
     redundant = True  # require redundant detections
     multi_label &= nc > 1  # multiple labels per box (adds 0.5ms/img)
     merge = False  # use merge-NMS
 
-    t = time.time()
-    output = [torch.zeros((0, 6 + nm), device=prediction.device)] * bs
-    for xi, x in enumerate(prediction):  # image index, image inference
-        # Apply constraints
-        # x[((x[:, 2:4] < min_wh) | (x[:, 2:4] > max_wh)).any(1), 4] = 0  # width-height
-        x = x.T[xc[xi]]  # confidence
-
-        # Cat apriori labels if autolabelling
-        if labels and len(labels[xi]):
-            lb = labels[xi]
-            v = torch.zeros((len(lb), nc + nm + 5), device=x.device)
-            v[:, :4] = lb[:, 1:5]  # box
-            v[range(len(lb)), lb[:, 0].long() + 4] = 1.0  # cls
-            x = torch.cat((x, v), 0)
-
-        # If none remain process next image
-        if not x.shape[0]:
-            continue
-
-        # Detections matrix nx6 (xyxy, conf, cls)
-        box, cls, mask = x.split((4, nc, nm), 1)
-        box = xywh2xyxy(box)  # center_x, center_y, width, height) to (x1, y1, x2, y2)
-        if multi_label:
-            i, j = (cls > conf_thres).nonzero(as_tuple=False).T
-            x = torch.cat((box[i], x[i, 4 + j, None], j[:, None].float(), mask[i]), 1)
-        else:  # best class only
-            conf, j = cls.max(1, keepdim=True)
-            x = torch.cat((box, conf, j.float(), mask), 1)[conf.view(-1) > conf_thres]
-
-        # Filter by class
-        if classes is not None:
-            x = x[(x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)]
-
-        # Apply finite constraint
-        # if not torch.isfinite(x).all():
-        #     x = x[torch.isfinite(x).all(1)]
-
-        # Check shape
-        n = x.shape[0]  # number of boxes
-        if not n:  # no boxes
-            continue
-        elif n > max_nms:  # excess boxes
-            x = x[x[:, 4].argsort(descending=True)[:max_nms]]  # sort by confidence
+    # Top-k pre-selection on class scores (bs,nc,anchors)
+    scores = prediction[:, 4:mi]
+    na = scores.shape[2]  # number of anchors
+    if topk_per_class and topk_per_class < na:  # candidates = union of the top-k anchors of each class
+        v, a = scores.topk(topk_per_class, 2)  # (bs,nc,k)
+        b, c, j = (v > conf_thres).nonzero(as_tuple=True)  # image, class, top-k index
+        a, v = a[b, c, j], v[b, c, j]
+        u, r = torch.unique(b * na + a, return_inverse=True)  # unique (image, anchor), sorted by image
+        b, a = u // na, u % na
+        cls = scores.new_zeros((len(u), nc))
+        cls[r, c] = v  # scores outside the top-k of their class stay zero
+        if topk:  # top-k anchors per image
+            i = cls.amax(1).argsort(descending=True)
+            i = i[torch.sort(b[i], stable=True)[1]]
+            i = i[rank_per_image(b[i], bs) < topk]
+            b, a, cls = b[i], a[i], cls[i]
+        x = prediction.transpose(1, 2)[b, a]  # candidates of all images (n,4+nc+nm), b = image index
+        x[:, 4:mi] = cls
+    else:
+        conf = scores.amax(1)  # (bs,anchors) best class score
+        k = min(topk or max_nms, na)
+        if k < na:  # top-k anchors per image
+            conf, a = conf.topk(k, 1)
+            b, j = (conf > conf_thres).nonzero(as_tuple=True)  # image, top-k index
+            a = a[b, j]
         else:
-            x = x[x[:, 4].argsort(descending=True)]  # sort by confidence
-
-        # Batched NMS
-        c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
-        boxes, scores = x[:, :4] + c, x[:, 4]  # boxes (offset by class), scores
-        i = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS
-        if i.shape[0] > max_det:  # limit detections
-            i = i[:max_det]
-        if merge and (1 < n < 3E3):  # Merge NMS (boxes merged using weighted mean)
-            # update boxes as boxes(i,4) = weights(i,n) * boxes(n,4)
-            iou = box_iou(boxes[i], boxes) > iou_thres  # iou matrix
-            weights = iou * scores[None]  # box weights
-            x[i, :4] = torch.mm(weights, x[:, :4]).float() / weights.sum(1, keepdim=True)  # merged boxes
-            if redundant:
-                i = i[iou.sum(1) > 1]  # require redundancy
-
-        output[xi] = x[i]
-        if mps:
-            output[xi] = output[xi].to(device)
-        if (time.time() - t) > time_limit:
-            LOGGER.warning(f'WARNING ⚠️ NMS time limit {time_limit:.3f}s exceeded')
-            break  # time limit exceeded
-
+            b, a = (conf > conf_thres).nonzero(as_tuple=True)  # image, anchor
+        x = prediction.transpose(1, 2)[b, a]  # candidates of all images (n,4+nc+nm), b = image index
+
+    # Cat apriori labels if autolabelling
+    lb = [(xi, v) for xi, v in enumerate(labels) if len(v)]
+    if lb:
+        v = torch.cat([v for _, v in lb]).to(x)
+        y = torch.zeros((len(v), mi + nm), device=x.device, dtype=x.dtype)
+        y[:, :4] = v[:, 1:5]  # box
+        y[range(len(v)), v[:, 0].long() + 4] = 1.0  # cls
+        x = torch.cat((x, y), 0)
+        b = torch.cat((b, torch.cat([torch.full((len(v),), xi, device=x.device) for xi, v in lb])))
+
+    # Detections matrix nx6 (xyxy, conf, cls)
+    box, cls, mask = x.split((4, nc, nm), 1)
+    box = xywh2xyxy(box)  # center_x, center_y, width, height) to (x1, y1, x2, y2)
+    if multi_label:
+        i, j = (cls > conf_thres).nonzero(as_tuple=False).T
+        x, b = torch.cat((box[i], x[i, 4 + j, None], j[:, None].float(), mask[i]), 1), b[i]
+    else:  # best class only
+        conf, j = cls.max(1, keepdim=True)
+        i = conf.view(-1) > conf_thres
+        x, b = torch.cat((box, conf, j.float(), mask), 1)[i], b[i]
+
+    # Filter by class
+    if classes is not None:
+        i = (x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)
+        x, b = x[i], b[i]
+
+    # Sort by image then confidence, keep at most max_nms boxes per image
+    i = x[:, 4].argsort(descending=True)
+    i = i[torch.sort(b[i], stable=True)[1]]
+    x, b = x[i], b[i]
+    i = rank_per_image(b, bs) < max_nms
+    x, b = x[i], b[i]
+
+    if engine != 'greedy':  # dense engine, rescores x[:, 4]
+        i = dense_nms(x, b, bs, engine, iou_thres, conf_thres, 0 if agnostic else max_wh)
+        i = i[rank_per_image(b[i], bs) < max_det]
+        n = torch.bincount(b[i], minlength=bs)  # detections per image
+        return [y.to(device) for y in x[i].split(n.tolist())]
+
+    # Batched NMS, boxes offset by image and class so that groups never overlap (as torchvision.ops.batched_nms)
+    g = b * (1 if agnostic else nc) + (0 if agnostic else x[:, 5].long())  # group index
+    boxes, scores = x[:, :4].float(), x[:, 4].float()  # float32, offsets exceed the FP16 range
+    if len(x):
+        boxes = boxes + g[:, None] * (boxes.max() + 1)  # offset by group
+    i = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS, descending score
+    if merge and (1 < len(x) < 3E3):  # Merge NMS (boxes merged using weighted mean)
+        # update boxes as boxes(i,4) = weights(i,n) * boxes(n,4)
+        iou = box_iou(boxes[i], boxes) > iou_thres  # iou matrix
+        weights = (iou * scores[None]).to(x.dtype)  # box weights
+        x[i, :4] = torch.mm(weights, x[:, :4]) / weights.sum(1, keepdim=True)  # merged boxes
+        if redundant:
+            i = i[iou.sum(1) > 1]  # require redundancy
+
+    # Split per image, keep at most max_det per image in confidence order
+    i = i[torch.sort(b[i], stable=True)[1]]
+    i = i[rank_per_image(b[i], bs) < max_det]
+    n = torch.bincount(b[i], minlength=bs)  # detections per image
+    output = list(x[i].split(n.tolist()))
+    if mps:
+        output = [x.to(device) for x in output]
     return output
 
 
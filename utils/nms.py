@@ -0,0 +1,99 @@
+"""
+NMS engines for non_max_suppression(engine=...)
+
+    greedy:   torchvision.ops.nms, one call for the whole batch (default)
+    matrix:   Matrix-NMS https://arxiv.org/abs/2003.10152, decays scores with one IoU matrix, no sequential step
+    cluster:  Cluster-NMS https://arxiv.org/abs/2005.03572, same result as greedy NMS from a few matrix iterations
+    soft:     Soft-NMS https://arxiv.org/abs/1704.04503, decays instead of removing overlapping boxes
+
+The dense engines (matrix, cluster, soft) work on score-sorted candidates padded to (bs,k,4) boxes and (bs,k) scores
+and return rescored (bs,k) scores, suppressed boxes scoring 0. Padding boxes are zero-area and never suppress.
+"""
+
+import torch
+
+
+def rank_per_image(b, bs):
+    # Position of each box within its image, for image indices b sorted ascending
+    n = torch.bincount(b, minlength=bs)
+    return torch.arange(len(b), device=b.device) - (n.cumsum(0) - n)[b]
+
+
+def batch_box_iou(boxes):
+    # IoU of all box pairs per image, boxes(bs,k,4) xyxy -> (bs,k,k)
+    area = (boxes[..., 2:] - boxes[..., :2]).clamp(0).prod(2)
+    lt = torch.max(boxes[:, :, None, :2], boxes[:, None, :, :2])
+    rb = torch.min(boxes[:, :, None, 2:], boxes[:, None, :, 2:])
+    inter = (rb - lt).clamp(0).prod(3)
+    return inter / (area[:, :, None] + area[:, None] - inter).clamp(1e-7)
+
+
+def upper(iou):
+    # Keep iou[:, i, j] for i < j, i.e. i scoring higher than j (exportable torch.triu(1))
+    r = torch.arange(iou.shape[1], device=iou.device)
+    return iou * (r[:, None] < r[None])
+
+
+def matrix_nms(boxes, scores, iou_thres=0.45, kernel='gaussian', sigma=2.0):
+    # Matrix-NMS: box j decays by its overlap with every higher scoring box i, compensated by how suppressed i itself
+    # is. iou_thres is unused, the caller thresholds the decayed scores
+    iou = upper(batch_box_iou(boxes))  # iou[i, j] for i scoring higher than j
+    comp = iou.amax(1)[:, :, None]  # (bs,k,1) max IoU of box i with any higher scoring box
+    if kernel == 'gaussian':
+        decay = torch.exp(-sigma * (iou ** 2 - comp ** 2))
+    else:  # linear
+        decay = (1 - iou) / (1 - comp).clamp(1e-7)
+    return scores * decay.amin(1)
+
+
+def cluster_nms(boxes, scores, iou_thres=0.45, iters=None):
+    # Cluster-NMS: boxes suppressed only by kept higher scoring boxes, iterated to a fixed point (greedy NMS result).
+    # iters=None stops at convergence, a fixed iters is traceable for export
+    iou = upper(batch_box_iou(boxes))
+    keep = torch.ones_like(scores)
+    for _ in range(iters or boxes.shape[1]):
+        prev = keep
+        keep = ((iou * keep[:, :, None]).amax(1) <= iou_thres).to(scores.dtype)
+        if iters is None and torch.equal(keep, prev):
+            break
+    return scores * keep
+
+
+def soft_nms(boxes, scores, iou_thres=0.3, sigma=0.5, kernel='gaussian'):
+    # Soft-NMS: repeatedly take the highest remaining box and decay the others by their IoU with it. Sequential over
+    # the k candidates, vectorized over the batch
+    iou = batch_box_iou(boxes)
+    bs, k = scores.shape
+    b = torch.arange(bs, device=scores.device)
+    done = torch.zeros_like(scores, dtype=torch.bool)
+    for _ in range(k):
+        i = scores.masked_fill(done, -1).argmax(1)  # highest remaining box per image
+        done[b, i] = True
+        o = iou[b, i]  # (bs,k) IoU with it
+        decay = torch.exp(-o ** 2 / sigma) if kernel == 'gaussian' else torch.where(o > iou_thres, 1 - o, 1)
+        scores = torch.where(done, scores, scores * decay)
+    return scores
+
+
+ENGINES = {'matrix': matrix_nms, 'cluster': cluster_nms, 'soft': soft_nms}  # dense engines
+NMS_ENGINES = ('greedy', *ENGINES)
+
+
+def dense_nms(x, b, bs, engine='matrix', iou_thres=0.45, conf_thres=0.25, max_wh=7680, max_k=1000, **kwargs):
+    # Dense engine NMS of candidates x(n,6+nm) [xyxy, conf, cls, masks] sorted by image then confidence, b(n,) image
+    # indices. The top max_k of each image are rescored together, x[:, 4] is updated in place. Returns the indices of
+    # boxes scoring above conf_thres, sorted by image then new score
+    r = rank_per_image(b, bs)
+    i = (r < max_k).nonzero().view(-1)
+    if not len(i):
+        return i
+    bi, r = b[i], r[i]
+    k = int(r.max()) + 1
+    boxes, scores = x.new_zeros(bs, k, 4), x.new_zeros(bs, k)
+    boxes[bi, r] = x[i, :4] + x[i, 5:6] * max_wh  # offset by class, max_wh=0 for class-agnostic NMS
+    scores[bi, r] = x[i, 4]
+    x[i, 4] = ENGINES[engine](boxes, scores, iou_thres, **kwargs)[bi, r]
+    keep = x[i, 4] > conf_thres
+    i, bi = i[keep], bi[keep]
+    j = x[i, 4].argsort(descending=True)
+    return i[j[torch.sort(bi[j], stable=True)[1]]]
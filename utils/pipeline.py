@@ -0,0 +1,203 @@
+import collections
+import threading
+import time
+
+from utils.general import LOGGER
+
+DROP_POLICIES = 'block', 'oldest'  # supported bounded queue drop policies
+
+
+class EndOfStream:
+    # Sentinel passed down a Pipeline when a source is exhausted or stopped
+    pass
+
+
+EOS = EndOfStream()
+
+
+class StageQueue:
+    # Bounded FIFO between two pipeline stages. policy='block' waits for space, policy='oldest' drops the oldest item
+    def __init__(self, maxsize=4, policy='block'):
+        assert policy in DROP_POLICIES, f'Invalid drop policy {policy}, valid values are {DROP_POLICIES}'
+        self.maxsize = max(int(maxsize), 1)
+        self.policy = policy
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.dropped = 0  # number of items discarded by the 'oldest' policy
+        self.closed = False
+
+    def put(self, item, timeout=0.1):
+        # Put item, returns False if the queue was closed (or stayed full past timeout with policy='block')
+        with self.cond:
+            if item is not EOS and self.policy == 'oldest':
+                while len(self.items) >= self.maxsize and not self.closed:
+                    self.items.popleft()
+                    self.dropped += 1
+            elif item is not EOS:
+                end = time.monotonic() + timeout
+                while len(self.items) >= self.maxsize and not self.closed:
+                    remaining = end - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+            if self.closed:
+                return False
+            self.items.append(item)
+            self.cond.notify_all()
+            return True
+
+    def get(self, timeout=0.1):
+        # Get the next item, returns None if nothing arrived before timeout
+        with self.cond:
+            if not self.items:
+                self.cond.wait(timeout)
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        # Wake up all waiters and refuse further items
+        with self.cond:
+            self.closed = True
+            self.items.clear()
+            self.cond.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+
+class StageStats:
+    # Per-stage counters: processed items, latency (last/mean/max ms), errors
+    def __init__(self, name):
+        self.name = name
+        self.n = 0  # items processed
+        self.errors = 0
+        self.t = 0.0  # accumulated seconds
+        self.last = 0.0  # last latency (s)
+        self.max = 0.0  # worst latency (s)
+        self.observer = None  # optional callable(name, dt) per item, i.e. utils.telemetry.Telemetry.watch()
+        self.lock = threading.Lock()
+
+    def update(self, dt):
+        with self.lock:
+            self.n += 1
+            self.t += dt
+            self.last = dt
+            self.max = max(self.max, dt)
+        if self.observer:
+            self.observer(self.name, dt)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'n': self.n,
+                'errors': self.errors,
+                'last_ms': self.last * 1E3,
+                'mean_ms': self.t / max(self.n, 1) * 1E3,
+                'max_ms': self.max * 1E3}
+
+
+class Stage:
+    # Pipeline stage running fn(item) -> item in its own daemon thread. Returning None drops the item.
+    def __init__(self, name, fn, maxsize=4, policy='block'):
+        self.name = name
+        self.fn = fn
+        self.inq = StageQueue(maxsize, policy)  # input queue
+        self.outq = None  # set by Pipeline
+        self.stats = StageStats(name)
+
+    def run(self, stop):
+        while not stop.is_set():
+            item = self.inq.get()
+            if item is None:
+                continue
+            if item is EOS:
+                self.outq.put(EOS)
+                break
+            t = time.perf_counter()
+            try:
+                item = self.fn(item)
+            except Exception as e:
+                self.stats.errors += 1
+                LOGGER.warning(f'WARNING ⚠️ pipeline stage {self.name} failed: {e}')
+                continue
+            self.stats.update(time.perf_counter() - t)
+            if item is not None:
+                while not self.outq.put(item) and not stop.is_set():
+                    pass  # block policy, wait for downstream space
+
+
+class Pipeline:
+    # Bounded multi-stage pipeline, one thread per stage, i.e. capture -> preprocess -> inference -> tracking -> render
+    # Usage: p = Pipeline(frames, [('preprocess', f1), ('inference', f2, 'block')], maxsize=2, policy='oldest').start()
+    #        while (item := p.get()) is not EOS: ...
+    def __init__(self, source, stages, maxsize=4, policy='block'):
+        self.source = source  # iterable producing items, consumed by the 'capture' thread
+        self.stages = [Stage(s[0], s[1], maxsize, s[2] if len(s) > 2 else policy) for s in stages]  # optional policy
+        self.output = StageQueue(maxsize, policy)  # results for the consumer
+        for a, b in zip(self.stages, self.stages[1:] + [None]):
+            a.outq = b.inq if b else self.output
+        self.capture = StageStats('capture')
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def _produce(self):
+        first = self.stages[0].inq if self.stages else self.output
+        it = iter(self.source)
+        try:
+            while not self.stop_event.is_set():
+                t = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    LOGGER.warning(f'WARNING ⚠️ pipeline capture failed: {e}')
+                    break
+                self.capture.update(time.perf_counter() - t)
+                while not first.put(item) and not self.stop_event.is_set():
+                    pass
+        finally:
+            close = getattr(it, 'close', None)
+            if close:
+                close()  # run the source generator's cleanup now, not when the Pipeline is garbage collected
+            first.put(EOS)
+
+    def start(self):
+        self.threads = [threading.Thread(target=self._produce, name='capture', daemon=True)]
+        self.threads += [threading.Thread(target=s.run, args=(self.stop_event,), name=s.name, daemon=True)
+                         for s in self.stages]
+        for t in self.threads:
+            t.start()
+        return self
+
+    def get(self, timeout=0.1):
+        # Next processed item, EOS at the end of the stream, None if nothing is ready yet
+        return self.output.get(timeout)
+
+    def stop(self, timeout=1.0):
+        self.stop_event.set()
+        for q in [s.inq for s in self.stages] + [self.output]:
+            q.close()
+        for t in self.threads:
+            if t is not threading.current_thread():
+                t.join(timeout)
+
+    @property
+    def running(self):
+        return any(t.is_alive() for t in self.threads)
+
+    def stats(self):
+        # Per-stage latency and queue depth counters, i.e. {'inference': {'mean_ms': 41.2, 'queue': 2, ...}, ...}
+        s = {'capture': self.capture.as_dict()}
+        for stage in self.stages:
+            s[stage.name] = {**stage.stats.as_dict(), 'queue': len(stage.inq), 'dropped': stage.inq.dropped}
+        s['output'] = {'queue': len(self.output), 'dropped': self.output.dropped}
+        return s
+
+    def summary(self):
+        # One-line string summary of stats()
+        s = self.stats()
+        return ', '.join(f"{k} {v['mean_ms']:.1f}ms q{v.get('queue', 0)}" for k, v in s.items() if 'mean_ms' in v)
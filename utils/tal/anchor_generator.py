@@ -1,3 +1,6 @@
+import threading
+from collections import OrderedDict
+
 import torch
 
 from utils.general import check_version
@@ -20,6 +23,36 @@ def make_anchors(feats, strides, grid_cell_offset=0.5):
     return torch.cat(anchor_points), torch.cat(stride_tensor)
 
 
+class AnchorCache:
+    """LRU cache of transposed make_anchors() outputs for a Detect head, keyed by (H, W) of every level, dtype and
+    device. Variable input shapes (rect batches, several streams) reuse their anchors instead of rebuilding them."""
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __call__(self, feats, strides, grid_cell_offset=0.5, cache=True):
+        # Returns anchors (2,n) and strides (1,n), cache=False always rebuilds them (i.e. dynamic shape export)
+        if not cache:
+            return tuple(x.transpose(0, 1) for x in make_anchors(feats, strides, grid_cell_offset))
+        k = (*(tuple(x.shape[2:]) for x in feats), grid_cell_offset, feats[0].dtype, feats[0].device)
+        with self.lock:
+            v = self.cache.pop(k, None)
+            if v is None:
+                v = tuple(x.transpose(0, 1) for x in make_anchors(feats, strides, grid_cell_offset))
+            self.cache[k] = v  # most recently used last
+            while len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+        return v
+
+    def __getstate__(self):
+        return {'maxsize': self.maxsize}  # not pickled with the model
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
 def dist2bbox(distance, anchor_points, xywh=True, dim=-1):
     """Transform distance(ltrb) to box(xywh or xyxy)."""
     lt, rb = torch.split(distance, 2, dim)
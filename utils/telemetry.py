@@ -0,0 +1,215 @@
+"""
+Prometheus metrics for running pipelines, i.e. main.py or a LoadStreams-based loop
+
+Usage:
+    from utils.telemetry import Telemetry
+    telemetry = Telemetry().serve(9100)  # http://127.0.0.1:9100/metrics
+    telemetry.watch(pipeline, stream='cam1')  # stage latency histograms, queue depths, dropped frames
+    telemetry.observe('nms', dt, stream='cam1')  # any other timing
+"""
+
+import collections
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psutil
+import torch
+
+from utils.general import LOGGER, colorstr
+
+BUCKETS = (.001, .0025, .005, .01, .02, .035, .05, .075, .1, .15, .25, .5, 1.0, 2.5)  # latency buckets (s)
+
+
+def _labels(d):
+    # {'stream': 'cam1'} -> '{stream="cam1"}'
+    esc = lambda v: str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{k}="{esc(v)}"' for k, v in d.items()) + '}' if d else ''
+
+
+class Metric:
+    # Prometheus metric with labelled children and text exposition
+    # https://prometheus.io/docs/instrumenting/exposition_formats
+    type = 'untyped'
+
+    def __init__(self, name, help='', labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.values = collections.OrderedDict()  # label values tuple -> value
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(k, '')) for k in self.labels)
+
+    def samples(self):
+        # (suffix, labels dict, value) tuples
+        with self.lock:
+            return [('', dict(zip(self.labels, k)), v) for k, v in self.values.items()]
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines += [f'{self.name}{s}{_labels(d)} {float(v):g}' for s, d, v in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, n=1, **labels):
+        k = self._key(labels)
+        with self.lock:
+            self.values[k] = self.values.get(k, 0) + n
+
+    def set(self, v, **labels):
+        # For totals counted elsewhere, i.e. StageQueue.dropped
+        with self.lock:
+            self.values[self._key(labels)] = v
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, v, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = v
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help='', labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, v, **labels):
+        k = self._key(labels)
+        with self.lock:
+            h = self.values.get(k)
+            if h is None:
+                h = self.values[k] = [[0] * len(self.buckets), 0, 0.0]  # bucket counts, count, sum
+            for i, b in enumerate(self.buckets):
+                if v <= b:
+                    h[0][i] += 1
+                    break
+            h[1] += 1
+            h[2] += v
+
+    def samples(self):
+        out = []
+        with self.lock:
+            for k, (counts, n, total) in self.values.items():
+                d, c = dict(zip(self.labels, k)), 0
+                for b, x in zip(self.buckets, counts):
+                    c += x  # cumulative
+                    out.append(('_bucket', {**d, 'le': f'{b:g}'}, c))
+                out += [('_bucket', {**d, 'le': '+Inf'}, n), ('_sum', d, total), ('_count', d, n)]
+        return out
+
+
+class Telemetry:
+    # Process-wide metrics registry for pipeline stages, streams and system utilization
+    def __init__(self):
+        labels = 'stream', 'stage'
+        self.latency = Histogram('yolo_stage_latency_seconds', 'Per-item latency of a pipeline stage', labels)
+        self.items = Counter('yolo_stage_items_total', 'Items processed by a pipeline stage', labels)
+        self.errors = Counter('yolo_stage_errors_total', 'Items that raised in a pipeline stage', labels)
+        self.queue = Gauge('yolo_queue_depth', 'Items waiting in front of a pipeline stage', labels)
+        self.dropped = Counter('yolo_dropped_frames_total', 'Frames dropped by a full queue or stream', labels)
+        self.cpu = Gauge('yolo_cpu_percent', 'System CPU utilization')
+        self.rss = Gauge('yolo_process_memory_bytes', 'Resident memory of this process')
+        self.gpu = Gauge('yolo_gpu_percent', 'GPU utilization (requires pynvml)', ('device',))
+        self.gpu_mem = Gauge('yolo_gpu_memory_bytes', 'GPU memory allocated by torch', ('device',))
+        self.metrics = [self.latency, self.items, self.errors, self.queue, self.dropped, self.cpu, self.rss, self.gpu,
+                        self.gpu_mem]
+        self.collectors = {}  # callables run before each scrape, by watched stream
+        self.process = psutil.Process()
+        self.server = None
+
+    def register(self, metric):
+        # Add a custom metric, returns it
+        self.metrics.append(metric)
+        return metric
+
+    def observe(self, stage, dt, stream='default'):
+        # Record one stage latency dt (s)
+        self.latency.observe(dt, stream=stream, stage=stage)
+        self.items.inc(stream=stream, stage=stage)
+
+    def watch(self, pipeline, stream='default'):
+        # Instrument a utils.pipeline.Pipeline: latency per item for every stage, queue depths and drops at scrape time
+        def observer(name, dt):
+            self.observe('decode' if name == 'capture' else name, dt, stream)
+
+        for s in [pipeline.capture] + [s.stats for s in pipeline.stages]:
+            s.observer = observer
+
+        def collect():
+            for s in pipeline.stages:
+                self.queue.set(len(s.inq), stream=stream, stage=s.name)
+                self.dropped.set(s.inq.dropped, stream=stream, stage=s.name)
+                self.errors.set(s.stats.errors, stream=stream, stage=s.name)
+            self.queue.set(len(pipeline.output), stream=stream, stage='output')
+            self.dropped.set(pipeline.output.dropped, stream=stream, stage='output')
+
+        self.collectors[stream] = collect  # replaces the pipeline previously watched under this name
+        return self
+
+    def watch_streams(self, dataset):
+        # Instrument a utils.dataloaders.LoadStreams: decode latency per stream and frames never consumed
+        dataset.telemetry = self
+
+        def collect():
+            for s, n in zip(dataset.sources, dataset.dropped):
+                self.dropped.set(n, stream=s, stage='stream')
+
+        self.collectors[id(dataset)] = collect
+        return self
+
+    def collect_system(self):
+        self.cpu.set(psutil.cpu_percent(interval=None))
+        self.rss.set(self.process.memory_info().rss)
+        for i in range(torch.cuda.device_count()):
+            self.gpu_mem.set(torch.cuda.memory_allocated(i), device=i)
+            try:
+                self.gpu.set(torch.cuda.utilization(i), device=i)
+            except Exception:  # pynvml not installed
+                pass
+
+    def expose(self):
+        # Prometheus text format of all metrics
+        for f in list(self.collectors.values()):
+            try:
+                f()
+            except Exception as e:
+                LOGGER.warning(f'WARNING ⚠️ telemetry collector failed: {e}')
+        self.collect_system()
+        return '\n'.join(m.expose() for m in self.metrics) + '\n'
+
+    def serve(self, port=9100, host='127.0.0.1'):
+        # Serve GET /metrics from a daemon thread, returns self
+        telemetry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = telemetry.expose().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='telemetry', daemon=True).start()
+        LOGGER.info(f"{colorstr('telemetry:')} serving metrics on http://{host}:{port}/metrics")
+        return self
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
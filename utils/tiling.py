@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+import torch
+import torchvision
+
+from utils.torch_utils import smart_inference_mode
+
+
+def tile_windows(shape, tile=640, overlap=0.2, rois=None, full=True):
+    # Overlapping tile windows (n,4) [x1, y1, x2, y2] covering image shape(h,w), or only the regions of interest
+    # rois: optional list of [x1, y1, x2, y2] pixel regions. full=True adds each whole region as one extra window
+    h, w = shape[:2]
+    regions = rois if rois is not None and len(rois) else [[0, 0, w, h]]
+    step = max(int(tile * (1 - overlap)), 1)
+    windows = []
+    for x1, y1, x2, y2 in regions:
+        x1, y1, x2, y2 = max(int(x1), 0), max(int(y1), 0), min(int(x2), w), min(int(y2), h)
+        if x2 <= x1 or y2 <= y1:
+            continue
+        rw, rh = x2 - x1, y2 - y1
+        nx, ny = math.ceil(max(rw - tile, 0) / step) + 1, math.ceil(max(rh - tile, 0) / step) + 1
+        xs = np.minimum(x1 + np.arange(nx) * step, max(x2 - tile, x1))  # last tile flush with the region edge
+        ys = np.minimum(y1 + np.arange(ny) * step, max(y2 - tile, y1))
+        for y in ys:
+            for x in xs:
+                windows.append([x, y, min(x + tile, x2), min(y + tile, y2)])
+        if full and (rw > tile or rh > tile):
+            windows.append([x1, y1, x2, y2])  # downscaled whole region for objects larger than a tile
+    return np.array(windows, dtype=int).reshape(-1, 4)
+
+
+def merge_detections(det, iou_thres=0.5, metric='ios', agnostic=False, max_det=1000):
+    # Cross-tile NMS of det(n,6) [xyxy, conf, cls], returns kept indices. metric='ios' (intersection over the smaller
+    # box) also suppresses partial boxes of objects cut by a tile edge, metric='iou' is standard NMS
+    if not len(det):
+        return torch.zeros(0, dtype=torch.long, device=det.device)
+    boxes, scores, cls = det[:, :4], det[:, 4], det[:, 5]
+    if metric == 'iou':
+        i = torchvision.ops.batched_nms(boxes, scores, cls * (not agnostic), iou_thres)
+        return i[:max_det]
+    order = scores.argsort(descending=True)
+    b = boxes[order]
+    area = (b[:, 2:] - b[:, :2]).clamp(0).prod(1)
+    lt, rb = torch.max(b[:, None, :2], b[None, :, :2]), torch.min(b[:, None, 2:], b[None, :, 2:])
+    inter = (rb - lt).clamp(0).prod(2)
+    ios = inter / torch.min(area[:, None], area[None]).clamp(1e-7)
+    if not agnostic:
+        ios *= cls[order][:, None] == cls[order][None]
+    keep = ios.triu_(1).amax(0) <= iou_thres  # Fast NMS: suppressed by any higher scoring box
+    return order[keep][:max_det]
+
+
+@smart_inference_mode()
+def tiled_inference(model, im, tile=640, overlap=0.2, rois=None, full=True, iou_thres=0.5, metric='ios', embed=False):
+    # Tiled (SAHI-style) inference of one HWC image with an AutoShape model. All tiles go through the model in one
+    # batch, per-tile NMS uses the AutoShape settings, boxes are offset to image pixels and merged with cross-tile NMS.
+    # Returns det(n,6) [xyxy, conf, cls], or (det, embeds(n,c)) if embed=True. With rois only centers inside count
+    windows = tile_windows(im.shape, tile, overlap, rois, full)
+    crops = [im[y1:y2, x1:x2] for x1, y1, x2, y2 in windows]
+    x, _, _, shape0, shape1 = model.preprocess(crops, tile)
+    y = model(x)
+    if embed:
+        y, e = model.postprocess(y, shape0, shape1, embed=True)
+        e = torch.cat(e, 0)
+    else:
+        y = model.postprocess(y, shape0, shape1)
+    offsets = torch.tensor(windows[:, :2], device=x.device, dtype=y[0].dtype).repeat(1, 2)  # (n,4) xyxy offsets
+    det = torch.cat([d[:, :4] + o for d, o in zip(y, offsets)], 0)
+    det = torch.cat((det, torch.cat(y, 0)[:, 4:]), 1)
+    if rois is not None and len(rois):
+        c = (det[:, :2] + det[:, 2:4]) / 2  # box centers
+        r = torch.tensor(rois, device=det.device, dtype=det.dtype).view(-1, 4)
+        inside = ((c[:, None] >= r[None, :, :2]) & (c[:, None] <= r[None, :, 2:])).all(2).any(1)
+        det, e = det[inside], e[inside] if embed else None
+    i = merge_detections(det, iou_thres, metric, model.agnostic, model.max_det)
+    return (det[i], e[i]) if embed else det[i]
@@ -0,0 +1,311 @@
+import cv2
+import numpy as np
+
+from utils.general import LOGGER, check_requirements
+
+
+class BaseTracker:
+    # Tracker interface used by main.py. update() takes a single (n,6) numpy array [x1, y1, x2, y2, conf, cls] and
+    # returns track objects exposing track_id, is_confirmed(), to_ltrb(), get_det_class() and get_det_conf()
+    def update(self, dets, frame=None, embeds=None):
+        raise NotImplementedError
+
+    def predict(self, frame=None):
+        # Frame without detector run: advance the motion model only, no track counts this frame as a miss
+        raise NotImplementedError
+
+
+class DeepSortTracker(BaseTracker):
+    # deep_sort_realtime DeepSort wrapper fed with a single (n,6) numpy array [x1, y1, x2, y2, conf, cls]
+    # embedder='yolo' skips DeepSort's own appearance CNN, update() must then be given embeds, i.e. AutoShape.embed
+    def __init__(self, embedder='mobilenet', **kwargs):
+        check_requirements('deep-sort-realtime')
+        from deep_sort_realtime.deepsort_tracker import DeepSort
+        self.external = embedder == 'yolo'  # embeddings supplied by the detector
+        self.tracker = DeepSort(embedder=None if self.external else embedder, **kwargs)
+
+    def update(self, dets, frame=None, embeds=None):
+        # Update tracks with detections dets(n,6) and optional embeds(n,c), returns deep_sort_realtime Track objects
+        ltwh = dets[:, :4].copy()
+        ltwh[:, 2:] -= ltwh[:, :2]  # xyxy to ltwh
+        raw = list(zip(ltwh.tolist(), dets[:, 4].tolist(), dets[:, 5].astype(int).tolist()))
+        if self.external:
+            return self.tracker.update_tracks(raw, embeds=[] if embeds is None else list(embeds), frame=frame)
+        return self.tracker.update_tracks(raw, frame=frame)
+
+    def predict(self, frame=None):
+        # Kalman prediction only, tentative tracks are not marked missed. Appearance is only matched on detector frames
+        self.tracker.tracker.predict()
+        return self.tracker.tracker.tracks
+
+
+class KalmanFilterXYAH:
+    # Constant velocity Kalman filter on [cx, cy, aspect, h, vcx, vcy, va, vh], vectorized over all tracks at once
+    std_pos = 1 / 20  # position noise relative to box height
+    std_vel = 1 / 160  # velocity noise relative to box height
+
+    def __init__(self):
+        self.F = np.eye(8, dtype=np.float32)  # motion matrix
+        self.F[:4, 4:] = np.eye(4)
+        self.H = np.eye(4, 8, dtype=np.float32)  # observation matrix
+
+    def _std(self, h, pos, vel, a):
+        # (n,8) process noise stds scaled by box height h(n,)
+        h = h[:, None]
+        std = np.concatenate((pos * h, pos * h, np.full_like(h, a), pos * h,
+                              vel * h, vel * h, np.full_like(h, a * 0.1), vel * h), 1)
+        return std
+
+    def initiate(self, z):
+        # New tracks from measurements z(n,4) xyah -> mean(n,8), cov(n,8,8)
+        mean = np.concatenate((z, np.zeros_like(z)), 1)
+        std = self._std(z[:, 3], 2 * self.std_pos, 10 * self.std_vel, 1e-2)
+        return mean, np.einsum('ni,ij->nij', std ** 2, np.eye(8, dtype=np.float32))
+
+    def predict(self, mean, cov):
+        q = self._std(mean[:, 3], self.std_pos, self.std_vel, 1e-2) ** 2
+        mean = mean @ self.F.T
+        cov = self.F @ cov @ self.F.T
+        cov[:, range(8), range(8)] += q
+        return mean, cov
+
+    def update(self, mean, cov, z):
+        # Correct mean(n,8), cov(n,8,8) with measurements z(n,4)
+        h = mean[:, 3:4]
+        r = np.concatenate((self.std_pos * h, self.std_pos * h, np.full_like(h, 1e-1), self.std_pos * h), 1) ** 2
+        S = self.H @ cov @ self.H.T  # (n,4,4) innovation covariance
+        S[:, range(4), range(4)] += r
+        PHt = cov @ self.H.T  # (n,8,4)
+        K = np.linalg.solve(S, PHt.transpose(0, 2, 1)).transpose(0, 2, 1)  # (n,8,4) Kalman gain
+        mean = mean + (K @ (z - mean[:, :4])[..., None])[..., 0]
+        cov = cov - K @ S @ K.transpose(0, 2, 1)
+        return mean, cov
+
+
+def xyxy2xyah(x):
+    # (n,4) [x1, y1, x2, y2] to [cx, cy, w/h, h]
+    w, h = x[:, 2] - x[:, 0], x[:, 3] - x[:, 1]
+    return np.stack(((x[:, 0] + x[:, 2]) / 2, (x[:, 1] + x[:, 3]) / 2, w / np.maximum(h, 1e-6), h), 1)
+
+
+def xyah2xyxy(x):
+    # (n,4) [cx, cy, w/h, h] to [x1, y1, x2, y2]
+    w, h = x[:, 2] * x[:, 3], x[:, 3]
+    return np.stack((x[:, 0] - w / 2, x[:, 1] - h / 2, x[:, 0] + w / 2, x[:, 1] + h / 2), 1)
+
+
+def iou_matrix(a, b):
+    # IoU between all boxes a(n,4) and b(m,4) xyxy, returns (n,m)
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(1)
+    return inter / (area_a[:, None] + area_b[None] - inter + 1e-7)
+
+
+def linear_assignment(iou, thres):
+    # Match rows to columns maximizing IoU >= thres. Hungarian if scipy is available, else greedy
+    if not iou.size:
+        return np.empty((0, 2), dtype=int)
+    try:
+        from scipy.optimize import linear_sum_assignment
+        r, c = linear_sum_assignment(-iou)
+    except ImportError:  # greedy, highest IoU pair first
+        r, c = np.unravel_index(np.argsort(-iou, axis=None), iou.shape)
+        keep = iou[r, c] >= thres
+        r, c = r[keep], c[keep]
+        sel, used_r, used_c = np.zeros(len(r), dtype=bool), set(), set()
+        for i, (a, b) in enumerate(zip(r.tolist(), c.tolist())):
+            if a not in used_r and b not in used_c:
+                used_r.add(a)
+                used_c.add(b)
+                sel[i] = True
+        r, c = r[sel], c[sel]
+    m = iou[r, c] >= thres
+    return np.stack((r[m], c[m]), 1)
+
+
+class Track:
+    # Read-only view of one ByteTracker track, same accessors as deep_sort_realtime Track
+    __slots__ = 'track_id', 'ltrb', 'det_class', 'det_conf', 'confirmed', 'time_since_update'
+
+    def __init__(self, track_id, ltrb, det_class, det_conf, confirmed, time_since_update):
+        self.track_id = track_id
+        self.ltrb = ltrb
+        self.det_class = det_class
+        self.det_conf = det_conf
+        self.confirmed = confirmed
+        self.time_since_update = time_since_update
+
+    def is_confirmed(self):
+        return self.confirmed
+
+    def to_ltrb(self):
+        return self.ltrb
+
+    def get_det_class(self):
+        return self.det_class
+
+    def get_det_conf(self):
+        return self.det_conf  # None if the track was only predicted on this frame
+
+
+class ByteTracker(BaseTracker):
+    # ByteTrack-style IoU tracker https://arxiv.org/abs/2110.06864 with all track states held in numpy arrays.
+    # High-score detections are matched first, low-score ones then recover the remaining tracks. No appearance CNN:
+    # between detector frames predict() follows confirmed tracks by matching a small grayscale template of each track
+    def __init__(self,
+                 max_age=30,
+                 n_init=3,
+                 high_thres=0.5,
+                 low_thres=0.1,
+                 match_thres=0.2,
+                 low_match_thres=0.5,
+                 appearance=0.6,
+                 template=24):
+        self.max_age = max_age  # frames a track survives without detections
+        self.n_init = n_init  # consecutive hits to confirm a track
+        self.high_thres = high_thres  # first association / new track score threshold
+        self.low_thres = low_thres  # second association score threshold
+        self.match_thres = match_thres  # minimum IoU, first association
+        self.low_match_thres = low_match_thres  # minimum IoU, second association
+        self.appearance = appearance  # minimum template correlation to correct a predicted track, 0 disables
+        self.template = template  # template longest side (pixels)
+        self.kf = KalmanFilterXYAH()
+        self.next_id = 1
+        self.mean = np.zeros((0, 8), dtype=np.float32)
+        self.cov = np.zeros((0, 8, 8), dtype=np.float32)
+        self.ids = np.zeros(0, dtype=int)
+        self.cls = np.zeros(0, dtype=int)
+        self.conf = np.zeros(0, dtype=np.float32)
+        self.hits = np.zeros(0, dtype=int)
+        self.since = np.zeros(0, dtype=int)  # frames since last update
+        self.confirmed = np.zeros(0, dtype=bool)
+        self.templates = np.empty(0, dtype=object)  # (patch, scale) per track, grayscale crop of the last detection
+
+    def _match(self, tracks, dets, boxes, thres):
+        # IoU association of track indices to detection rows, different classes never match
+        iou = iou_matrix(boxes[tracks], dets[:, :4]) * (self.cls[tracks][:, None] == dets[:, 5][None].astype(int))
+        m = linear_assignment(iou, thres)
+        return tracks[m[:, 0]], m[:, 1]
+
+    def _keep(self, keep):
+        for k in 'mean', 'cov', 'ids', 'cls', 'conf', 'hits', 'since', 'confirmed', 'templates':
+            setattr(self, k, getattr(self, k)[keep])
+
+    def _tracks(self):
+        boxes = xyah2xyxy(self.mean[:, :4]).tolist()
+        return [
+            Track(int(i), b, int(c), None if np.isnan(s) else float(s), bool(ok), int(u))
+            for i, b, c, s, ok, u in zip(self.ids, boxes, self.cls, self.conf, self.confirmed, self.since)]
+
+    def _templates(self, gray, boxes):
+        # (patch, scale) templates cropped from gray at boxes(n,4) xyxy, None where the box is outside the frame
+        out = np.empty(len(boxes), dtype=object)
+        for i, (x1, y1, x2, y2) in enumerate(boxes.round().astype(int).tolist()):
+            x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(x2, gray.shape[1]), min(y2, gray.shape[0])
+            if x2 - x1 > 1 and y2 - y1 > 1:
+                s = min(self.template / max(x2 - x1, y2 - y1), 1.0)
+                size = max(round((x2 - x1) * s), 1), max(round((y2 - y1) * s), 1)
+                out[i] = cv2.resize(gray[y1:y2, x1:x2], size, interpolation=cv2.INTER_AREA), s
+        return out
+
+    def _follow(self, gray):
+        # Correct predicted confirmed tracks with the best template match in a window around each prediction
+        boxes = xyah2xyxy(self.mean[:, :4])
+        t, z = [], []
+        for i in np.nonzero(self.confirmed)[0]:
+            if self.templates[i] is None:
+                continue
+            patch, s = self.templates[i]
+            x1, y1, x2, y2 = boxes[i]
+            m = 0.5 * max(x2 - x1, y2 - y1)  # search margin
+            wx1, wy1 = max(int(x1 - m), 0), max(int(y1 - m), 0)
+            wx2, wy2 = min(int(x2 + m), gray.shape[1]), min(int(y2 + m), gray.shape[0])
+            size = round((wx2 - wx1) * s), round((wy2 - wy1) * s)
+            if size[0] < patch.shape[1] or size[1] < patch.shape[0]:
+                continue
+            window = cv2.resize(gray[wy1:wy2, wx1:wx2], size, interpolation=cv2.INTER_AREA)
+            _, score, _, loc = cv2.minMaxLoc(cv2.matchTemplate(window, patch, cv2.TM_CCOEFF_NORMED))
+            if score >= self.appearance:
+                t.append(i)
+                z.append((wx1 + (loc[0] + patch.shape[1] / 2) / s, wy1 + (loc[1] + patch.shape[0] / 2) / s))
+        if t:
+            t = np.array(t)
+            z = np.concatenate((np.array(z, dtype=np.float32), self.mean[t, 2:4]), 1)  # keep predicted a, h
+            self.mean[t], self.cov[t] = self.kf.update(self.mean[t], self.cov[t], z)
+
+    def predict(self, frame=None):
+        # Frame without detector run: Kalman prediction plus template matching (if frame is given). Tentative tracks
+        # are kept until the next detector frame, confirmed tracks still expire after max_age frames
+        if len(self.ids):
+            self.mean, self.cov = self.kf.predict(self.mean, self.cov)
+        self.since += 1
+        self.conf[:] = np.nan
+        if frame is not None and self.appearance and self.confirmed.any():
+            self._follow(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame)
+        self._keep(~self.confirmed | (self.since <= self.max_age))
+        return self._tracks()
+
+    def update(self, dets, frame=None, embeds=None):
+        # Update tracks with detections dets(n,6) [x1, y1, x2, y2, conf, cls], returns list of Track
+        dets = np.asarray(dets, dtype=np.float32).reshape(-1, 6)
+        if len(self.ids):
+            self.mean, self.cov = self.kf.predict(self.mean, self.cov)
+        self.since += 1
+        boxes = xyah2xyxy(self.mean[:, :4])
+
+        # Associate
+        high, low = dets[:, 4] >= self.high_thres, (dets[:, 4] >= self.low_thres) & (dets[:, 4] < self.high_thres)
+        hi, lo = np.nonzero(high)[0], np.nonzero(low)[0]
+        t1, d1 = self._match(np.arange(len(self.ids)), dets[hi], boxes, self.match_thres)
+        rest = np.setdiff1d(np.nonzero(self.confirmed)[0], t1)
+        t2, d2 = self._match(rest, dets[lo], boxes, self.low_match_thres)
+        t, d = np.concatenate((t1, t2)), np.concatenate((hi[d1], lo[d2]))
+
+        # Update matched tracks
+        self.conf[:] = np.nan
+        if len(t):
+            self.mean[t], self.cov[t] = self.kf.update(self.mean[t], self.cov[t], xyxy2xyah(dets[d, :4]))
+            self.cls[t], self.conf[t] = dets[d, 5].astype(int), dets[d, 4]
+            self.hits[t] += 1
+            self.since[t] = 0
+            self.confirmed[t] |= self.hits[t] >= self.n_init
+        gray = None
+        if frame is not None and self.appearance:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+            if len(t):
+                self.templates[t] = self._templates(gray, dets[d, :4])
+
+        # Remove tentative tracks that missed and tracks lost for too long
+        self._keep((self.since == 0) | (self.confirmed & (self.since <= self.max_age)))
+
+        # New tracks from unmatched high-score detections
+        new = np.setdiff1d(hi, d)
+        if len(new):
+            mean, cov = self.kf.initiate(xyxy2xyah(dets[new, :4]))
+            n = len(new)
+            self.mean = np.concatenate((self.mean, mean.astype(np.float32)))
+            self.cov = np.concatenate((self.cov, cov.astype(np.float32)))
+            self.ids = np.concatenate((self.ids, np.arange(self.next_id, self.next_id + n)))
+            self.cls = np.concatenate((self.cls, dets[new, 5].astype(int)))
+            self.conf = np.concatenate((self.conf, dets[new, 4]))
+            self.hits = np.concatenate((self.hits, np.ones(n, dtype=int)))
+            self.since = np.concatenate((self.since, np.zeros(n, dtype=int)))
+            self.confirmed = np.concatenate((self.confirmed, np.full(n, self.n_init <= 1)))
+            templates = self._templates(gray, dets[new, :4]) if gray is not None else np.empty(n, dtype=object)
+            self.templates = np.concatenate((self.templates, templates))
+            self.next_id += n
+
+        return self._tracks()
+
+
+TRACKERS = {'deepsort': DeepSortTracker, 'bytetrack': ByteTracker}
+
+
+def create_tracker(name='deepsort', **kwargs):
+    # Tracker factory, i.e. create_tracker('bytetrack', max_age=30)
+    assert name in TRACKERS, f'Invalid tracker {name}, valid values are {tuple(TRACKERS)}'
+    LOGGER.info(f'Tracker: {name} {kwargs}')
+    return TRACKERS[name](**kwargs)